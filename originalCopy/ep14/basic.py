@@ -4,17 +4,18 @@
 
 from strings_with_arrows import *
 
-import string
+import re
 import os
 import math
-
-#######################################
-# CONSTANTS
-#######################################
-
-DIGITS = '0123456789'
-LETTERS = string.ascii_letters
-LETTERS_DIGITS = LETTERS + DIGITS
+import hashlib
+import bisect
+import sys
+import mmap
+import gc
+import array
+import marshal
+import struct
+import collections
 
 #######################################
 # ERRORS
@@ -57,73 +58,115 @@ class RTError(Error):
     return result
 
   def generate_traceback(self):
-    result = ''
+    lines = []
     pos = self.pos_start
     ctx = self.context
 
     while ctx:
-      result = f'  File {pos.fn}, line {str(pos.ln + 1)}, in {ctx.display_name}\n' + result
+      lines.append(f'  File {pos.fn}, line {str(pos.ln + 1)}, in {ctx.display_name}\n')
       pos = ctx.parent_entry_pos
       ctx = ctx.parent
 
-    return 'Traceback (most recent call last):\n' + result
+    return 'Traceback (most recent call last):\n' + ''.join(reversed(lines))
 
 #######################################
 # POSITION
 #######################################
 
+class Source:
+  def __init__(self, fn, text=None):
+    self.fn = fn
+    self._text = text
+    self.line_starts = None
+
+  @property
+  def text(self):
+    # A streamed file is only read again when an error has to show it
+    if self._text == None:
+      with open(self.fn, "r") as f:
+        self._text = f.read()
+    return self._text
+
+  def line_col(self, idx):
+    # Lines are only indexed once an error asks where an offset is
+    if self.line_starts == None:
+      self.line_starts = [0] + [m.end() for m in re.finditer('\n', self.text)]
+
+    ln = bisect.bisect_right(self.line_starts, idx) - 1
+    return ln, idx - self.line_starts[ln]
+
 class Position:
-  def __init__(self, idx, ln, col, fn, ftxt):
+  __slots__ = ('idx', 'source', 'is_end')
+
+  def __init__(self, idx, source, is_end=False):
     self.idx = idx
-    self.ln = ln
-    self.col = col
-    self.fn = fn
-    self.ftxt = ftxt
+    self.source = source
+    self.is_end = is_end
 
-  def advance(self, current_char=None):
-    self.idx += 1
-    self.col += 1
+  def line_col(self):
+    # The end of a span stays on the line of its last character, even when
+    # that character is a newline
+    if self.is_end and self.idx > 0:
+      ln, col = self.source.line_col(self.idx - 1)
+      return ln, col + 1
+    return self.source.line_col(self.idx)
 
-    if current_char == '\n':
-      self.ln += 1
-      self.col = 0
+  @property
+  def ln(self):
+    return self.line_col()[0]
 
-    return self
+  @property
+  def col(self):
+    return self.line_col()[1]
+
+  @property
+  def fn(self):
+    return self.source.fn
+
+  @property
+  def ftxt(self):
+    return self.source.text
 
   def copy(self):
-    return Position(self.idx, self.ln, self.col, self.fn, self.ftxt)
+    return self
 
 #######################################
 # TOKENS
 #######################################
 
-TT_INT				= 'INT'
-TT_FLOAT    	= 'FLOAT'
-TT_STRING			= 'STRING'
-TT_IDENTIFIER	= 'IDENTIFIER'
-TT_KEYWORD		= 'KEYWORD'
-TT_PLUS     	= 'PLUS'
-TT_MINUS    	= 'MINUS'
-TT_MUL      	= 'MUL'
-TT_DIV      	= 'DIV'
-TT_POW				= 'POW'
-TT_EQ					= 'EQ'
-TT_LPAREN   	= 'LPAREN'
-TT_RPAREN   	= 'RPAREN'
-TT_LSQUARE    = 'LSQUARE'
-TT_RSQUARE    = 'RSQUARE'
-TT_EE					= 'EE'
-TT_NE					= 'NE'
-TT_LT					= 'LT'
-TT_GT					= 'GT'
-TT_LTE				= 'LTE'
-TT_GTE				= 'GTE'
-TT_COMMA			= 'COMMA'
-TT_ARROW			= 'ARROW'
-TT_NEWLINE		= 'NEWLINE'
-TT_EOF				= 'EOF'
-
-KEYWORDS = [
+TT_INT        = 0
+TT_FLOAT      = 1
+TT_STRING     = 2
+TT_IDENTIFIER = 3
+TT_KEYWORD    = 4
+TT_PLUS       = 5
+TT_MINUS      = 6
+TT_MUL        = 7
+TT_DIV        = 8
+TT_POW        = 9
+TT_EQ         = 10
+TT_LPAREN     = 11
+TT_RPAREN     = 12
+TT_LSQUARE    = 13
+TT_RSQUARE    = 14
+TT_EE         = 15
+TT_NE         = 16
+TT_LT         = 17
+TT_GT         = 18
+TT_LTE        = 19
+TT_GTE        = 20
+TT_COMMA      = 21
+TT_ARROW      = 22
+TT_NEWLINE    = 23
+TT_EOF        = 24
+
+TOKEN_NAMES = [
+  'INT', 'FLOAT', 'STRING', 'IDENTIFIER', 'KEYWORD', 'PLUS', 'MINUS', 'MUL', 'DIV', 'POW',
+  'EQ', 'LPAREN', 'RPAREN', 'LSQUARE', 'RSQUARE', 'EE', 'NE', 'LT', 'GT', 'LTE', 'GTE',
+  'COMMA', 'ARROW', 'NEWLINE', 'EOF',
+]
+
+KEYWORDS = frozenset([
   'VAR',
   'AND',
   'OR',
@@ -141,232 +184,184 @@ KEYWORDS = [
   'RETURN',
   'CONTINUE',
   'BREAK',
-]
+])
 
 class Token:
-  def __init__(self, type_, value=None, pos_start=None, pos_end=None):
+  # A token only keeps offsets into its source; Positions are made on demand
+  __slots__ = ('type', 'value', 'start', 'end', 'source')
+
+  def __init__(self, type_, value, start, end, source):
     self.type = type_
     self.value = value
+    self.start = start
+    self.end = end
+    self.source = source
 
-    if pos_start:
-      self.pos_start = pos_start.copy()
-      self.pos_end = pos_start.copy()
-      self.pos_end.advance()
+  @property
+  def pos_start(self):
+    return Position(self.start, self.source)
 
-    if pos_end:
-      self.pos_end = pos_end.copy()
+  @property
+  def pos_end(self):
+    return Position(self.end, self.source, True)
 
   def matches(self, type_, value):
     return self.type == type_ and self.value == value
   
   def __repr__(self):
-    if self.value: return f'{self.type}:{self.value}'
-    return f'{self.type}'
+    if self.value: return f'{TOKEN_NAMES[self.type]}:{self.value}'
+    return f'{TOKEN_NAMES[self.type]}'
 
 #######################################
 # LEXER
 #######################################
 
+# One alternative per kind of lexeme, tried in order at the current offset.
+# A comment swallows the newline that ends it, and a backslash in a string
+# is dropped while the character after it is kept as it is
+TOKEN_REGEX = re.compile(r'''
+    (?P<identifier>[A-Za-z][A-Za-z0-9_]*)
+  | (?P<skip>[ \t]+|\#[^\n]*\n?)
+  | (?P<operator>->|==|<=|>=|!=|[-+*/^()\[\]=<>,])
+  | (?P<number>[0-9]+(?:\.[0-9]*)?)
+  | (?P<newline>[;\n])
+  | (?P<string>"[^"]*"?)
+  | (?P<illegal>[\s\S])
+''', re.VERBOSE)
+
+OPERATOR_TOKENS = {
+  '+': TT_PLUS,
+  '-': TT_MINUS,
+  '*': TT_MUL,
+  '/': TT_DIV,
+  '^': TT_POW,
+  '(': TT_LPAREN,
+  ')': TT_RPAREN,
+  '[': TT_LSQUARE,
+  ']': TT_RSQUARE,
+  '=': TT_EQ,
+  '==': TT_EE,
+  '!=': TT_NE,
+  '<': TT_LT,
+  '>': TT_GT,
+  '<=': TT_LTE,
+  '>=': TT_GTE,
+  ',': TT_COMMA,
+  '->': TT_ARROW,
+}
+
+# Characters read from a file at a time by the streaming lexer
+LEXER_CHUNK_SIZE = 1 << 16
+
 class Lexer:
-  def __init__(self, fn, text):
+  def __init__(self, fn, text=None, file=None):
     self.fn = fn
     self.text = text
-    self.pos = Position(-1, 0, -1, fn, text)
-    self.current_char = None
-    self.advance()
-  
-  def advance(self):
-    self.pos.advance(self.current_char)
-    self.current_char = self.text[self.pos.idx] if self.pos.idx < len(self.text) else None
+    self.file = file
+    self.error = None
 
   def make_tokens(self):
-    tokens = []
-
-    while self.current_char != None:
-      if self.current_char in ' \t':
-        self.advance()
-      elif self.current_char == '#':
-        self.skip_comment()
-      elif self.current_char in ';\n':
-        tokens.append(Token(TT_NEWLINE, pos_start=self.pos))
-        self.advance()
-      elif self.current_char in DIGITS:
-        tokens.append(self.make_number())
-      elif self.current_char in LETTERS:
-        tokens.append(self.make_identifier())
-      elif self.current_char == '"':
-        tokens.append(self.make_string())
-      elif self.current_char == '+':
-        tokens.append(Token(TT_PLUS, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '-':
-        tokens.append(self.make_minus_or_arrow())
-      elif self.current_char == '*':
-        tokens.append(Token(TT_MUL, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '/':
-        tokens.append(Token(TT_DIV, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '^':
-        tokens.append(Token(TT_POW, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '(':
-        tokens.append(Token(TT_LPAREN, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == ')':
-        tokens.append(Token(TT_RPAREN, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '[':
-        tokens.append(Token(TT_LSQUARE, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == ']':
-        tokens.append(Token(TT_RSQUARE, pos_start=self.pos))
-        self.advance()
-      elif self.current_char == '!':
-        token, error = self.make_not_equals()
-        if error: return [], error
-        tokens.append(token)
-      elif self.current_char == '=':
-        tokens.append(self.make_equals())
-      elif self.current_char == '<':
-        tokens.append(self.make_less_than())
-      elif self.current_char == '>':
-        tokens.append(self.make_greater_than())
-      elif self.current_char == ',':
-        tokens.append(Token(TT_COMMA, pos_start=self.pos))
-        self.advance()
-      else:
-        pos_start = self.pos.copy()
-        char = self.current_char
-        self.advance()
-        return [], IllegalCharError(pos_start, self.pos, "'" + char + "'")
-
-    tokens.append(Token(TT_EOF, pos_start=self.pos))
+    tokens = list(self.generate_tokens())
+    if self.error: return [], self.error
     return tokens, None
 
-  def make_number(self):
-    num_str = ''
-    dot_count = 0
-    pos_start = self.pos.copy()
-
-    while self.current_char != None and self.current_char in DIGITS + '.':
-      if self.current_char == '.':
-        if dot_count == 1: break
-        dot_count += 1
-      num_str += self.current_char
-      self.advance()
-
-    if dot_count == 0:
-      return Token(TT_INT, int(num_str), pos_start, self.pos)
+  def generate_tokens(self):
+    # Yields tokens as they are lexed. Text from a file is read in chunks, and
+    # a lexeme that reaches the end of a chunk is lexed again with the next
+    # one. On an error, self.error is set and the tokens end with EOF
+    if self.file:
+      source = Source(self.fn)
+      chunks = iter(lambda: self.file.read(LEXER_CHUNK_SIZE), '')
     else:
-      return Token(TT_FLOAT, float(num_str), pos_start, self.pos)
-
-  def make_string(self):
-    string = ''
-    pos_start = self.pos.copy()
-    escape_character = False
-    self.advance()
-
-    escape_characters = {
-      'n': '\n',
-      't': '\t'
-    }
-
-    while self.current_char != None and (self.current_char != '"' or escape_character):
-      if escape_character:
-        string += escape_characters.get(self.current_char, self.current_char)
-      else:
-        if self.current_char == '\\':
-          escape_character = True
+      source = Source(self.fn, self.text)
+      chunks = iter([self.text])
+
+    rest = ''
+    base = end = 0
+    at_eof = False
+
+    while not at_eof:
+      chunk = next(chunks, '')
+      at_eof = not chunk
+      text = rest + chunk if rest else chunk
+      rest = ''
+
+      for m in TOKEN_REGEX.finditer(text):
+        start, end = m.span()
+        if end == len(text) and not at_eof:
+          rest = text[start:]
+          break
+
+        kind = m.lastgroup
+        lexeme = m.group()
+        start += base
+        end += base
+
+        if kind == 'identifier':
+          yield Token(TT_KEYWORD if lexeme in KEYWORDS else TT_IDENTIFIER, sys.intern(lexeme), start, end, source)
+        elif kind == 'skip':
+          pass
+        elif kind == 'operator':
+          yield Token(OPERATOR_TOKENS[lexeme], None, start, end, source)
+        elif kind == 'number':
+          if '.' in lexeme:
+            yield Token(TT_FLOAT, float(lexeme), start, end, source)
+          else:
+            yield Token(TT_INT, int(lexeme), start, end, source)
+        elif kind == 'newline':
+          yield Token(TT_NEWLINE, None, start, end, source)
+        elif kind == 'string':
+          if lexeme[-1] == '"' and len(lexeme) > 1:
+            value = lexeme[1:-1]
+          else:
+            # An unterminated string runs to the end, one past the last character
+            value = lexeme[1:]
+            end += 1
+          yield Token(TT_STRING, value.replace('\\', ''), start, end, source)
+        elif lexeme == '!':
+          # The character after '!' is consumed along with it
+          self.error = ExpectedCharError(Position(start, source), Position(start + 2, source), "'=' (after '!')")
+          break
         else:
-          string += self.current_char
-      self.advance()
-      escape_character = False
-    
-    self.advance()
-    return Token(TT_STRING, string, pos_start, self.pos)
-
-  def make_identifier(self):
-    id_str = ''
-    pos_start = self.pos.copy()
-
-    while self.current_char != None and self.current_char in LETTERS_DIGITS + '_':
-      id_str += self.current_char
-      self.advance()
-
-    tok_type = TT_KEYWORD if id_str in KEYWORDS else TT_IDENTIFIER
-    return Token(tok_type, id_str, pos_start, self.pos)
-
-  def make_minus_or_arrow(self):
-    tok_type = TT_MINUS
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '>':
-      self.advance()
-      tok_type = TT_ARROW
-
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-  def make_not_equals(self):
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '=':
-      self.advance()
-      return Token(TT_NE, pos_start=pos_start, pos_end=self.pos), None
+          self.error = IllegalCharError(Position(start, source), Position(end, source, True), "'" + lexeme + "'")
+          break
 
-    self.advance()
-    return None, ExpectedCharError(pos_start, self.pos, "'=' (after '!')")
-  
-  def make_equals(self):
-    tok_type = TT_EQ
-    pos_start = self.pos.copy()
-    self.advance()
-
-    if self.current_char == '=':
-      self.advance()
-      tok_type = TT_EE
-
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-  def make_less_than(self):
-    tok_type = TT_LT
-    pos_start = self.pos.copy()
-    self.advance()
+      if self.error: break
+      base += len(text) - len(rest)
 
-    if self.current_char == '=':
-      self.advance()
-      tok_type = TT_LTE
-
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
-
-  def make_greater_than(self):
-    tok_type = TT_GT
-    pos_start = self.pos.copy()
-    self.advance()
+    yield Token(TT_EOF, None, end, end + 1, source)
 
-    if self.current_char == '=':
-      self.advance()
-      tok_type = TT_GTE
+#######################################
+# NODES
+#######################################
 
-    return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
+class Node:
+  # Nodes are slotted, as a large program makes millions of them. Each class
+  # lists the fields the resolver and the marking passes add to it as well
+  __slots__ = ('pos_start', 'pos_end', 'result_used')
 
-  def skip_comment(self):
-    self.advance()
+NODE_SLOTS = {}
 
-    while self.current_char != '\n':
-      self.advance()
+def copy_node(node):
+  # A shallow copy of a node, twice as fast as copy.copy on slotted classes.
+  # Slots that were never set stay unset
+  node_type = type(node)
+  names = NODE_SLOTS.get(node_type)
+  if names == None:
+    names = NODE_SLOTS[node_type] = tuple(name for cls in node_type.__mro__ for name in cls.__dict__.get('__slots__', ()))
 
-    self.advance()
+  new_node = node_type.__new__(node_type)
+  for name in names:
+    value = getattr(node, name, NODE_SLOTS)
+    if value is not NODE_SLOTS: setattr(new_node, name, value)
+  return new_node
 
-#######################################
-# NODES
-#######################################
+class NumberNode(Node):
+  __slots__ = ('tok', 'constant')
 
-class NumberNode:
   def __init__(self, tok):
     self.tok = tok
+    self.constant = make_number(tok.value)
 
     self.pos_start = self.tok.pos_start
     self.pos_end = self.tok.pos_end
@@ -374,9 +369,12 @@ class NumberNode:
   def __repr__(self):
     return f'{self.tok}'
 
-class StringNode:
+class StringNode(Node):
+  __slots__ = ('tok', 'constant')
+
   def __init__(self, tok):
     self.tok = tok
+    self.constant = String(tok.value)
 
     self.pos_start = self.tok.pos_start
     self.pos_end = self.tok.pos_end
@@ -384,21 +382,27 @@ class StringNode:
   def __repr__(self):
     return f'{self.tok}'
 
-class ListNode:
+class ListNode(Node):
+  __slots__ = ('element_nodes',)
+
   def __init__(self, element_nodes, pos_start, pos_end):
     self.element_nodes = element_nodes
 
     self.pos_start = pos_start
     self.pos_end = pos_end
 
-class VarAccessNode:
+class VarAccessNode(Node):
+  __slots__ = ('var_name_tok', 'scopes', 'depth', 'slot')
+
   def __init__(self, var_name_tok):
     self.var_name_tok = var_name_tok
 
     self.pos_start = self.var_name_tok.pos_start
     self.pos_end = self.var_name_tok.pos_end
 
-class VarAssignNode:
+class VarAssignNode(Node):
+  __slots__ = ('var_name_tok', 'value_node', 'scope', 'slot')
+
   def __init__(self, var_name_tok, value_node):
     self.var_name_tok = var_name_tok
     self.value_node = value_node
@@ -406,11 +410,15 @@ class VarAssignNode:
     self.pos_start = self.var_name_tok.pos_start
     self.pos_end = self.value_node.pos_end
 
-class BinOpNode:
+class BinOpNode(Node):
+  __slots__ = ('left_node', 'op_tok', 'right_node', 'operator', 'short_circuits')
+
   def __init__(self, left_node, op_tok, right_node):
     self.left_node = left_node
     self.op_tok = op_tok
     self.right_node = right_node
+    self.operator = BINARY_OPERATORS[binary_op_method(op_tok)]
+    self.short_circuits = op_tok.type == TT_KEYWORD
 
     self.pos_start = self.left_node.pos_start
     self.pos_end = self.right_node.pos_end
@@ -418,7 +426,9 @@ class BinOpNode:
   def __repr__(self):
     return f'({self.left_node}, {self.op_tok}, {self.right_node})'
 
-class UnaryOpNode:
+class UnaryOpNode(Node):
+  __slots__ = ('op_tok', 'node')
+
   def __init__(self, op_tok, node):
     self.op_tok = op_tok
     self.node = node
@@ -429,7 +439,9 @@ class UnaryOpNode:
   def __repr__(self):
     return f'({self.op_tok}, {self.node})'
 
-class IfNode:
+class IfNode(Node):
+  __slots__ = ('cases', 'else_case')
+
   def __init__(self, cases, else_case):
     self.cases = cases
     self.else_case = else_case
@@ -437,7 +449,9 @@ class IfNode:
     self.pos_start = self.cases[0][0].pos_start
     self.pos_end = (self.else_case or self.cases[len(self.cases) - 1])[0].pos_end
 
-class ForNode:
+class ForNode(Node):
+  __slots__ = ('var_name_tok', 'start_value_node', 'end_value_node', 'step_value_node', 'body_node', 'should_return_null', 'scope', 'slot')
+
   def __init__(self, var_name_tok, start_value_node, end_value_node, step_value_node, body_node, should_return_null):
     self.var_name_tok = var_name_tok
     self.start_value_node = start_value_node
@@ -449,7 +463,9 @@ class ForNode:
     self.pos_start = self.var_name_tok.pos_start
     self.pos_end = self.body_node.pos_end
 
-class WhileNode:
+class WhileNode(Node):
+  __slots__ = ('condition_node', 'body_node', 'should_return_null')
+
   def __init__(self, condition_node, body_node, should_return_null):
     self.condition_node = condition_node
     self.body_node = body_node
@@ -458,7 +474,9 @@ class WhileNode:
     self.pos_start = self.condition_node.pos_start
     self.pos_end = self.body_node.pos_end
 
-class FuncDefNode:
+class FuncDefNode(Node):
+  __slots__ = ('var_name_tok', 'arg_name_toks', 'body_node', 'should_auto_return', 'scope', 'slot', 'body_scope')
+
   def __init__(self, var_name_tok, arg_name_toks, body_node, should_auto_return):
     self.var_name_tok = var_name_tok
     self.arg_name_toks = arg_name_toks
@@ -474,7 +492,36 @@ class FuncDefNode:
 
     self.pos_end = self.body_node.pos_end
 
-class CallNode:
+class LazyBodyNode(Node):
+  # The tokens of a FUN body, up to and including its END, that a lazy
+  # parser skipped. The body is parsed the first time its function runs,
+  # and prepared again only if it is called with a new scope. Each run
+  # works on its own copy of the node, and the copies share the parsed body
+  __slots__ = ('tokens', 'parsed', 'scope', 'body_node')
+
+  def __init__(self, tokens):
+    self.tokens = tokens
+    self.parsed = []
+    self.scope = None
+    self.body_node = None
+
+    self.pos_start = self.tokens[0].pos_start
+    self.pos_end = self.tokens[-1].pos_end
+
+  def load(self, scope):
+    if not self.parsed:
+      ast = Parser(self.tokens, lazy=True).parse_body()
+      if ast.error: raise RTException(ast.error)
+      self.parsed.append(ast.node)
+
+    if self.scope is not scope:
+      self.body_node = prepare_function_body(self.parsed[0], scope)
+      self.scope = scope
+    return self.body_node
+
+class CallNode(Node):
+  __slots__ = ('node_to_call', 'arg_nodes', 'is_tail_call')
+
   def __init__(self, node_to_call, arg_nodes):
     self.node_to_call = node_to_call
     self.arg_nodes = arg_nodes
@@ -486,830 +533,1184 @@ class CallNode:
     else:
       self.pos_end = self.node_to_call.pos_end
 
-class ReturnNode:
+class ReturnNode(Node):
+  __slots__ = ('node_to_return',)
+
   def __init__(self, node_to_return, pos_start, pos_end):
     self.node_to_return = node_to_return
 
     self.pos_start = pos_start
     self.pos_end = pos_end
 
-class ContinueNode:
+class ContinueNode(Node):
+  __slots__ = ()
+
   def __init__(self, pos_start, pos_end):
     self.pos_start = pos_start
     self.pos_end = pos_end
 
-class BreakNode:
+class BreakNode(Node):
+  __slots__ = ()
+
   def __init__(self, pos_start, pos_end):
     self.pos_start = pos_start
     self.pos_end = pos_end
 
+def child_nodes(node):
+  if isinstance(node, ListNode):
+    return node.element_nodes
+  if isinstance(node, VarAssignNode):
+    return [node.value_node]
+  if isinstance(node, BinOpNode):
+    return [node.left_node, node.right_node]
+  if isinstance(node, UnaryOpNode):
+    return [node.node]
+  if isinstance(node, IfNode):
+    children = []
+    for condition, expr, _ in node.cases:
+      children.extend((condition, expr))
+    if node.else_case:
+      children.append(node.else_case[0])
+    return children
+  if isinstance(node, ForNode):
+    children = [node.start_value_node, node.end_value_node]
+    if node.step_value_node:
+      children.append(node.step_value_node)
+    children.append(node.body_node)
+    return children
+  if isinstance(node, WhileNode):
+    return [node.condition_node, node.body_node]
+  if isinstance(node, FuncDefNode):
+    return [node.body_node]
+  if isinstance(node, CallNode):
+    return [node.node_to_call] + node.arg_nodes
+  if isinstance(node, ReturnNode):
+    return [node.node_to_return] if node.node_to_return else []
+  return []
+
 #######################################
 # PARSE RESULT
 #######################################
 
 class ParseResult:
-  def __init__(self):
-    self.error = None
-    self.node = None
-    self.last_registered_advance_count = 0
-    self.advance_count = 0
-    self.to_reverse_count = 0
-
-  def register_advancement(self):
-    self.last_registered_advance_count = 1
-    self.advance_count += 1
-
-  def register(self, res):
-    self.last_registered_advance_count = res.advance_count
-    self.advance_count += res.advance_count
-    if res.error: self.error = res.error
-    return res.node
-
-  def try_register(self, res):
-    if res.error:
-      self.to_reverse_count = res.advance_count
-      return None
-    return self.register(res)
-
-  def success(self, node):
+  def __init__(self, node=None, error=None):
     self.node = node
-    return self
+    self.error = error
 
-  def failure(self, error):
-    if not self.error or self.last_registered_advance_count == 0:
-      self.error = error
-    return self
+class ParseException(Exception):
+  def __init__(self, error):
+    super().__init__(error)
+    self.error = error
 
 #######################################
 # PARSER
 #######################################
 
+# The tokens each rule can start with. The parser looks at the current token
+# to pick a rule, and never has to back out of one
+ATOM_START_TYPES = frozenset((TT_INT, TT_FLOAT, TT_STRING, TT_IDENTIFIER, TT_LPAREN, TT_LSQUARE))
+ATOM_START_KEYWORDS = frozenset(('IF', 'FOR', 'WHILE', 'FUN'))
+ARITH_START_TYPES = ATOM_START_TYPES | {TT_PLUS, TT_MINUS}
+COMP_START_KEYWORDS = ATOM_START_KEYWORDS | {'NOT'}
+EXPR_START_KEYWORDS = COMP_START_KEYWORDS | {'VAR'}
+STATEMENT_START_KEYWORDS = EXPR_START_KEYWORDS | {'RETURN', 'CONTINUE', 'BREAK'}
+
+LOGIC_PRECEDENCE      = 1
+COMPARISON_PRECEDENCE = 2
+SUM_PRECEDENCE        = 3
+PRODUCT_PRECEDENCE    = 4
+POW_PRECEDENCE        = 5
+
+BINARY_PRECEDENCE = {
+  TT_EE: COMPARISON_PRECEDENCE,
+  TT_NE: COMPARISON_PRECEDENCE,
+  TT_LT: COMPARISON_PRECEDENCE,
+  TT_GT: COMPARISON_PRECEDENCE,
+  TT_LTE: COMPARISON_PRECEDENCE,
+  TT_GTE: COMPARISON_PRECEDENCE,
+  TT_PLUS: SUM_PRECEDENCE,
+  TT_MINUS: SUM_PRECEDENCE,
+  TT_MUL: PRODUCT_PRECEDENCE,
+  TT_DIV: PRODUCT_PRECEDENCE,
+  TT_POW: POW_PRECEDENCE,
+}
+KEYWORD_PRECEDENCE = {
+  'AND': LOGIC_PRECEDENCE,
+  'OR': LOGIC_PRECEDENCE,
+}
+RIGHT_ASSOCIATIVE = frozenset((TT_POW, ))
+
 class Parser:
-  def __init__(self, tokens):
-    self.tokens = tokens
-    self.tok_idx = -1
+  def __init__(self, tokens, lazy=False):
+    # Tokens can be a list or come straight from Lexer.generate_tokens. The
+    # parser never steps back, so it only holds the current one. A lazy
+    # parser leaves multi-line FUN bodies as LazyBodyNodes
+    self.tokens = iter(tokens)
+    self.lazy = lazy
+    self.current_tok = None
     self.advance()
 
   def advance(self):
-    self.tok_idx += 1
-    self.update_current_tok()
+    self.current_tok = next(self.tokens, self.current_tok)
     return self.current_tok
 
-  def reverse(self, amount=1):
-    self.tok_idx -= amount
-    self.update_current_tok()
-    return self.current_tok
+  def starts(self, keywords):
+    tok = self.current_tok
+    return tok.type in ARITH_START_TYPES or (tok.type == TT_KEYWORD and tok.value in keywords)
 
-  def update_current_tok(self):
-    if self.tok_idx >= 0 and self.tok_idx < len(self.tokens):
-      self.current_tok = self.tokens[self.tok_idx]
+  def invalid_syntax(self, details):
+    return ParseException(InvalidSyntaxError(
+      self.current_tok.pos_start, self.current_tok.pos_end,
+      details
+    ))
 
   def parse(self):
-    res = self.statements()
-    if not res.error and self.current_tok.type != TT_EOF:
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        "Token cannot appear after previous tokens"
-      ))
-    return res
+    try:
+      node = self.statements()
+      if self.current_tok.type != TT_EOF:
+        raise self.invalid_syntax("Token cannot appear after previous tokens")
+    except ParseException as e:
+      return ParseResult(error=e.error)
+    return ParseResult(node)
 
   ###################################
 
   def statements(self):
-    res = ParseResult()
     statements = []
-    pos_start = self.current_tok.pos_start.copy()
+    pos_start = self.current_tok.pos_start
 
     while self.current_tok.type == TT_NEWLINE:
-      res.register_advancement()
       self.advance()
 
-    statement = res.register(self.statement())
-    if res.error: return res
-    statements.append(statement)
+    statements.append(self.statement())
 
-    more_statements = True
-
-    while True:
-      newline_count = 0
+    while self.current_tok.type == TT_NEWLINE:
       while self.current_tok.type == TT_NEWLINE:
-        res.register_advancement()
         self.advance()
-        newline_count += 1
-      if newline_count == 0:
-        more_statements = False
-      
-      if not more_statements: break
-      statement = res.try_register(self.statement())
-      if not statement:
-        self.reverse(res.to_reverse_count)
-        more_statements = False
-        continue
-      statements.append(statement)
 
-    return res.success(ListNode(
+      if not self.starts(STATEMENT_START_KEYWORDS): break
+      statements.append(self.statement())
+
+    return ListNode(
       statements,
       pos_start,
-      self.current_tok.pos_end.copy()
-    ))
+      self.current_tok.pos_end
+    )
 
   def statement(self):
-    res = ParseResult()
-    pos_start = self.current_tok.pos_start.copy()
+    pos_start = self.current_tok.pos_start
 
     if self.current_tok.matches(TT_KEYWORD, 'RETURN'):
-      res.register_advancement()
       self.advance()
 
-      expr = res.try_register(self.expr())
-      if not expr:
-        self.reverse(res.to_reverse_count)
-      return res.success(ReturnNode(expr, pos_start, self.current_tok.pos_start.copy()))
+      expr = self.expr() if self.starts(EXPR_START_KEYWORDS) else None
+      return ReturnNode(expr, pos_start, self.current_tok.pos_start)
     
     if self.current_tok.matches(TT_KEYWORD, 'CONTINUE'):
-      res.register_advancement()
       self.advance()
-      return res.success(ContinueNode(pos_start, self.current_tok.pos_start.copy()))
+      return ContinueNode(pos_start, self.current_tok.pos_start)
       
     if self.current_tok.matches(TT_KEYWORD, 'BREAK'):
-      res.register_advancement()
       self.advance()
-      return res.success(BreakNode(pos_start, self.current_tok.pos_start.copy()))
+      return BreakNode(pos_start, self.current_tok.pos_start)
 
-    expr = res.register(self.expr())
-    if res.error:
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
+    if not self.starts(EXPR_START_KEYWORDS):
+      raise self.invalid_syntax(
         "Expected 'RETURN', 'CONTINUE', 'BREAK', 'VAR', 'IF', 'FOR', 'WHILE', 'FUN', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
-      ))
-    return res.success(expr)
+      )
+    return self.expr()
 
   def expr(self):
-    res = ParseResult()
-
     if self.current_tok.matches(TT_KEYWORD, 'VAR'):
-      res.register_advancement()
       self.advance()
 
       if self.current_tok.type != TT_IDENTIFIER:
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
-          "Expected identifier"
-        ))
+        raise self.invalid_syntax("Expected identifier")
 
       var_name = self.current_tok
-      res.register_advancement()
       self.advance()
 
       if self.current_tok.type != TT_EQ:
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
-          "Expected '='"
-        ))
+        raise self.invalid_syntax("Expected '='")
 
-      res.register_advancement()
       self.advance()
-      expr = res.register(self.expr())
-      if res.error: return res
-      return res.success(VarAssignNode(var_name, expr))
-
-    node = res.register(self.bin_op(self.comp_expr, ((TT_KEYWORD, 'AND'), (TT_KEYWORD, 'OR'))))
+      return VarAssignNode(var_name, self.expr())
 
-    if res.error:
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
+    if not self.starts(COMP_START_KEYWORDS):
+      raise self.invalid_syntax(
         "Expected 'VAR', 'IF', 'FOR', 'WHILE', 'FUN', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
-      ))
-
-    return res.success(node)
+      )
 
-  def comp_expr(self):
-    res = ParseResult()
-
-    if self.current_tok.matches(TT_KEYWORD, 'NOT'):
-      op_tok = self.current_tok
-      res.register_advancement()
-      self.advance()
+    return self.binary(LOGIC_PRECEDENCE)
 
-      node = res.register(self.comp_expr())
-      if res.error: return res
-      return res.success(UnaryOpNode(op_tok, node))
-    
-    node = res.register(self.bin_op(self.arith_expr, (TT_EE, TT_NE, TT_LT, TT_GT, TT_LTE, TT_GTE)))
-    
-    if res.error:
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
+  def binary(self, precedence):
+    # Parses operands joined by operators that bind at least as tightly as
+    # precedence. A left-associative operator's right side only takes
+    # tighter operators; POW's right side takes POW again
+    if precedence <= COMPARISON_PRECEDENCE and not self.starts(COMP_START_KEYWORDS):
+      raise self.invalid_syntax(
         "Expected int, float, identifier, '+', '-', '(', '[', 'IF', 'FOR', 'WHILE', 'FUN' or 'NOT'"
-      ))
+      )
 
-    return res.success(node)
+    left = self.prefix(precedence)
 
-  def arith_expr(self):
-    return self.bin_op(self.term, (TT_PLUS, TT_MINUS))
+    while True:
+      op_tok = self.current_tok
+      if op_tok.type == TT_KEYWORD:
+        op_precedence = KEYWORD_PRECEDENCE.get(op_tok.value, 0)
+      else:
+        op_precedence = BINARY_PRECEDENCE.get(op_tok.type, 0)
+      if op_precedence < precedence: return left
 
-  def term(self):
-    return self.bin_op(self.factor, (TT_MUL, TT_DIV))
+      self.advance()
+      right = self.binary(op_precedence if op_tok.type in RIGHT_ASSOCIATIVE else op_precedence + 1)
+      left = BinOpNode(left, op_tok, right)
 
-  def factor(self):
-    res = ParseResult()
+  def prefix(self, precedence):
     tok = self.current_tok
 
-    if tok.type in (TT_PLUS, TT_MINUS):
-      res.register_advancement()
+    # NOT applies to a whole comparison, so it can only start an operand of
+    # AND or OR. + and - apply to a power
+    if tok.matches(TT_KEYWORD, 'NOT') and precedence <= COMPARISON_PRECEDENCE:
       self.advance()
-      factor = res.register(self.factor())
-      if res.error: return res
-      return res.success(UnaryOpNode(tok, factor))
+      return UnaryOpNode(tok, self.binary(COMPARISON_PRECEDENCE))
 
-    return self.power()
+    if tok.type in (TT_PLUS, TT_MINUS):
+      self.advance()
+      return UnaryOpNode(tok, self.binary(POW_PRECEDENCE))
 
-  def power(self):
-    return self.bin_op(self.call, (TT_POW, ), self.factor)
+    return self.call()
 
   def call(self):
-    res = ParseResult()
-    atom = res.register(self.atom())
-    if res.error: return res
+    atom = self.atom()
 
-    if self.current_tok.type == TT_LPAREN:
-      res.register_advancement()
-      self.advance()
-      arg_nodes = []
+    if self.current_tok.type != TT_LPAREN:
+      return atom
 
-      if self.current_tok.type == TT_RPAREN:
-        res.register_advancement()
-        self.advance()
-      else:
-        arg_nodes.append(res.register(self.expr()))
-        if res.error:
-          return res.failure(InvalidSyntaxError(
-            self.current_tok.pos_start, self.current_tok.pos_end,
-            "Expected ')', 'VAR', 'IF', 'FOR', 'WHILE', 'FUN', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
-          ))
+    self.advance()
+    arg_nodes = []
 
-        while self.current_tok.type == TT_COMMA:
-          res.register_advancement()
-          self.advance()
+    if self.current_tok.type == TT_RPAREN:
+      self.advance()
+      return CallNode(atom, arg_nodes)
 
-          arg_nodes.append(res.register(self.expr()))
-          if res.error: return res
+    if not self.starts(EXPR_START_KEYWORDS):
+      raise self.invalid_syntax(
+        "Expected ')', 'VAR', 'IF', 'FOR', 'WHILE', 'FUN', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
+      )
+    arg_nodes.append(self.expr())
 
-        if self.current_tok.type != TT_RPAREN:
-          return res.failure(InvalidSyntaxError(
-            self.current_tok.pos_start, self.current_tok.pos_end,
-            f"Expected ',' or ')'"
-          ))
+    while self.current_tok.type == TT_COMMA:
+      self.advance()
+      arg_nodes.append(self.expr())
 
-        res.register_advancement()
-        self.advance()
-      return res.success(CallNode(atom, arg_nodes))
-    return res.success(atom)
+    if self.current_tok.type != TT_RPAREN:
+      raise self.invalid_syntax("Expected ',' or ')'")
+
+    self.advance()
+    return CallNode(atom, arg_nodes)
 
   def atom(self):
-    res = ParseResult()
     tok = self.current_tok
 
     if tok.type in (TT_INT, TT_FLOAT):
-      res.register_advancement()
       self.advance()
-      return res.success(NumberNode(tok))
+      return NumberNode(tok)
 
     elif tok.type == TT_STRING:
-      res.register_advancement()
       self.advance()
-      return res.success(StringNode(tok))
+      return StringNode(tok)
 
     elif tok.type == TT_IDENTIFIER:
-      res.register_advancement()
       self.advance()
-      return res.success(VarAccessNode(tok))
+      return VarAccessNode(tok)
 
     elif tok.type == TT_LPAREN:
-      res.register_advancement()
       self.advance()
-      expr = res.register(self.expr())
-      if res.error: return res
-      if self.current_tok.type == TT_RPAREN:
-        res.register_advancement()
-        self.advance()
-        return res.success(expr)
-      else:
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
-          "Expected ')'"
-        ))
+      expr = self.expr()
+      if self.current_tok.type != TT_RPAREN:
+        raise self.invalid_syntax("Expected ')'")
+      self.advance()
+      return expr
 
     elif tok.type == TT_LSQUARE:
-      list_expr = res.register(self.list_expr())
-      if res.error: return res
-      return res.success(list_expr)
+      return self.list_expr()
     
     elif tok.matches(TT_KEYWORD, 'IF'):
-      if_expr = res.register(self.if_expr())
-      if res.error: return res
-      return res.success(if_expr)
+      return self.if_expr()
 
     elif tok.matches(TT_KEYWORD, 'FOR'):
-      for_expr = res.register(self.for_expr())
-      if res.error: return res
-      return res.success(for_expr)
+      return self.for_expr()
 
     elif tok.matches(TT_KEYWORD, 'WHILE'):
-      while_expr = res.register(self.while_expr())
-      if res.error: return res
-      return res.success(while_expr)
+      return self.while_expr()
 
     elif tok.matches(TT_KEYWORD, 'FUN'):
-      func_def = res.register(self.func_def())
-      if res.error: return res
-      return res.success(func_def)
+      return self.func_def()
 
-    return res.failure(InvalidSyntaxError(
-      tok.pos_start, tok.pos_end,
+    raise self.invalid_syntax(
       "Expected int, float, identifier, '+', '-', '(', '[', IF', 'FOR', 'WHILE', 'FUN'"
-    ))
+    )
 
   def list_expr(self):
-    res = ParseResult()
     element_nodes = []
-    pos_start = self.current_tok.pos_start.copy()
+    pos_start = self.current_tok.pos_start
 
     if self.current_tok.type != TT_LSQUARE:
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected '['"
-      ))
+      raise self.invalid_syntax("Expected '['")
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == TT_RSQUARE:
-      res.register_advancement()
       self.advance()
     else:
-      element_nodes.append(res.register(self.expr()))
-      if res.error:
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
+      if not self.starts(EXPR_START_KEYWORDS):
+        raise self.invalid_syntax(
           "Expected ']', 'VAR', 'IF', 'FOR', 'WHILE', 'FUN', int, float, identifier, '+', '-', '(', '[' or 'NOT'"
-        ))
+        )
+      element_nodes.append(self.expr())
 
       while self.current_tok.type == TT_COMMA:
-        res.register_advancement()
         self.advance()
-
-        element_nodes.append(res.register(self.expr()))
-        if res.error: return res
+        element_nodes.append(self.expr())
 
       if self.current_tok.type != TT_RSQUARE:
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
-          f"Expected ',' or ']'"
-        ))
+        raise self.invalid_syntax("Expected ',' or ']'")
 
-      res.register_advancement()
       self.advance()
 
-    return res.success(ListNode(
+    return ListNode(
       element_nodes,
       pos_start,
-      self.current_tok.pos_end.copy()
-    ))
+      self.current_tok.pos_end
+    )
 
   def if_expr(self):
-    res = ParseResult()
-    all_cases = res.register(self.if_expr_cases('IF'))
-    if res.error: return res
-    cases, else_case = all_cases
-    return res.success(IfNode(cases, else_case))
+    cases, else_case = self.if_expr_cases('IF')
+    return IfNode(cases, else_case)
 
   def if_expr_b(self):
     return self.if_expr_cases('ELIF')
     
   def if_expr_c(self):
-    res = ParseResult()
     else_case = None
 
     if self.current_tok.matches(TT_KEYWORD, 'ELSE'):
-      res.register_advancement()
       self.advance()
 
       if self.current_tok.type == TT_NEWLINE:
-        res.register_advancement()
         self.advance()
 
-        statements = res.register(self.statements())
-        if res.error: return res
+        statements = self.statements()
         else_case = (statements, True)
 
-        if self.current_tok.matches(TT_KEYWORD, 'END'):
-          res.register_advancement()
-          self.advance()
-        else:
-          return res.failure(InvalidSyntaxError(
-            self.current_tok.pos_start, self.current_tok.pos_end,
-            "Expected 'END'"
-          ))
+        if not self.current_tok.matches(TT_KEYWORD, 'END'):
+          raise self.invalid_syntax("Expected 'END'")
+        self.advance()
       else:
-        expr = res.register(self.statement())
-        if res.error: return res
-        else_case = (expr, False)
+        else_case = (self.statement(), False)
 
-    return res.success(else_case)
+    return else_case
 
   def if_expr_b_or_c(self):
-    res = ParseResult()
-    cases, else_case = [], None
-
     if self.current_tok.matches(TT_KEYWORD, 'ELIF'):
-      all_cases = res.register(self.if_expr_b())
-      if res.error: return res
-      cases, else_case = all_cases
-    else:
-      else_case = res.register(self.if_expr_c())
-      if res.error: return res
-    
-    return res.success((cases, else_case))
+      return self.if_expr_b()
+    return [], self.if_expr_c()
 
   def if_expr_cases(self, case_keyword):
-    res = ParseResult()
     cases = []
     else_case = None
 
     if not self.current_tok.matches(TT_KEYWORD, case_keyword):
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected '{case_keyword}'"
-      ))
+      raise self.invalid_syntax(f"Expected '{case_keyword}'")
 
-    res.register_advancement()
     self.advance()
 
-    condition = res.register(self.expr())
-    if res.error: return res
+    condition = self.expr()
 
     if not self.current_tok.matches(TT_KEYWORD, 'THEN'):
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected 'THEN'"
-      ))
+      raise self.invalid_syntax(f"Expected 'THEN'")
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == TT_NEWLINE:
-      res.register_advancement()
       self.advance()
 
-      statements = res.register(self.statements())
-      if res.error: return res
+      statements = self.statements()
       cases.append((condition, statements, True))
 
       if self.current_tok.matches(TT_KEYWORD, 'END'):
-        res.register_advancement()
         self.advance()
       else:
-        all_cases = res.register(self.if_expr_b_or_c())
-        if res.error: return res
-        new_cases, else_case = all_cases
+        new_cases, else_case = self.if_expr_b_or_c()
         cases.extend(new_cases)
     else:
-      expr = res.register(self.statement())
-      if res.error: return res
+      expr = self.statement()
       cases.append((condition, expr, False))
 
-      all_cases = res.register(self.if_expr_b_or_c())
-      if res.error: return res
-      new_cases, else_case = all_cases
+      new_cases, else_case = self.if_expr_b_or_c()
       cases.extend(new_cases)
 
-    return res.success((cases, else_case))
+    return cases, else_case
 
   def for_expr(self):
-    res = ParseResult()
-
     if not self.current_tok.matches(TT_KEYWORD, 'FOR'):
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected 'FOR'"
-      ))
+      raise self.invalid_syntax(f"Expected 'FOR'")
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type != TT_IDENTIFIER:
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected identifier"
-      ))
+      raise self.invalid_syntax(f"Expected identifier")
 
     var_name = self.current_tok
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type != TT_EQ:
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected '='"
-      ))
+      raise self.invalid_syntax(f"Expected '='")
     
-    res.register_advancement()
     self.advance()
 
-    start_value = res.register(self.expr())
-    if res.error: return res
+    start_value = self.expr()
 
     if not self.current_tok.matches(TT_KEYWORD, 'TO'):
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected 'TO'"
-      ))
+      raise self.invalid_syntax(f"Expected 'TO'")
     
-    res.register_advancement()
     self.advance()
 
-    end_value = res.register(self.expr())
-    if res.error: return res
+    end_value = self.expr()
 
     if self.current_tok.matches(TT_KEYWORD, 'STEP'):
-      res.register_advancement()
       self.advance()
-
-      step_value = res.register(self.expr())
-      if res.error: return res
+      step_value = self.expr()
     else:
       step_value = None
 
     if not self.current_tok.matches(TT_KEYWORD, 'THEN'):
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected 'THEN'"
-      ))
+      raise self.invalid_syntax(f"Expected 'THEN'")
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == TT_NEWLINE:
-      res.register_advancement()
       self.advance()
 
-      body = res.register(self.statements())
-      if res.error: return res
+      body = self.statements()
 
       if not self.current_tok.matches(TT_KEYWORD, 'END'):
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
-          f"Expected 'END'"
-        ))
+        raise self.invalid_syntax(f"Expected 'END'")
 
-      res.register_advancement()
       self.advance()
 
-      return res.success(ForNode(var_name, start_value, end_value, step_value, body, True))
+      return ForNode(var_name, start_value, end_value, step_value, body, True)
     
-    body = res.register(self.statement())
-    if res.error: return res
-
-    return res.success(ForNode(var_name, start_value, end_value, step_value, body, False))
+    body = self.statement()
+    return ForNode(var_name, start_value, end_value, step_value, body, False)
 
   def while_expr(self):
-    res = ParseResult()
-
     if not self.current_tok.matches(TT_KEYWORD, 'WHILE'):
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected 'WHILE'"
-      ))
+      raise self.invalid_syntax(f"Expected 'WHILE'")
 
-    res.register_advancement()
     self.advance()
 
-    condition = res.register(self.expr())
-    if res.error: return res
+    condition = self.expr()
 
     if not self.current_tok.matches(TT_KEYWORD, 'THEN'):
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected 'THEN'"
-      ))
+      raise self.invalid_syntax(f"Expected 'THEN'")
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == TT_NEWLINE:
-      res.register_advancement()
       self.advance()
 
-      body = res.register(self.statements())
-      if res.error: return res
+      body = self.statements()
 
       if not self.current_tok.matches(TT_KEYWORD, 'END'):
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
-          f"Expected 'END'"
-        ))
+        raise self.invalid_syntax(f"Expected 'END'")
 
-      res.register_advancement()
       self.advance()
 
-      return res.success(WhileNode(condition, body, True))
+      return WhileNode(condition, body, True)
     
-    body = res.register(self.statement())
-    if res.error: return res
-
-    return res.success(WhileNode(condition, body, False))
+    body = self.statement()
+    return WhileNode(condition, body, False)
 
   def func_def(self):
-    res = ParseResult()
-
     if not self.current_tok.matches(TT_KEYWORD, 'FUN'):
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected 'FUN'"
-      ))
+      raise self.invalid_syntax(f"Expected 'FUN'")
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == TT_IDENTIFIER:
       var_name_tok = self.current_tok
-      res.register_advancement()
       self.advance()
       if self.current_tok.type != TT_LPAREN:
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
-          f"Expected '('"
-        ))
+        raise self.invalid_syntax(f"Expected '('")
     else:
       var_name_tok = None
       if self.current_tok.type != TT_LPAREN:
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
-          f"Expected identifier or '('"
-        ))
+        raise self.invalid_syntax(f"Expected identifier or '('")
     
-    res.register_advancement()
     self.advance()
     arg_name_toks = []
 
     if self.current_tok.type == TT_IDENTIFIER:
       arg_name_toks.append(self.current_tok)
-      res.register_advancement()
       self.advance()
       
       while self.current_tok.type == TT_COMMA:
-        res.register_advancement()
         self.advance()
 
         if self.current_tok.type != TT_IDENTIFIER:
-          return res.failure(InvalidSyntaxError(
-            self.current_tok.pos_start, self.current_tok.pos_end,
-            f"Expected identifier"
-          ))
+          raise self.invalid_syntax(f"Expected identifier")
 
         arg_name_toks.append(self.current_tok)
-        res.register_advancement()
         self.advance()
       
       if self.current_tok.type != TT_RPAREN:
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
-          f"Expected ',' or ')'"
-        ))
+        raise self.invalid_syntax(f"Expected ',' or ')'")
     else:
       if self.current_tok.type != TT_RPAREN:
-        return res.failure(InvalidSyntaxError(
-          self.current_tok.pos_start, self.current_tok.pos_end,
-          f"Expected identifier or ')'"
-        ))
+        raise self.invalid_syntax(f"Expected identifier or ')'")
 
-    res.register_advancement()
     self.advance()
 
     if self.current_tok.type == TT_ARROW:
-      res.register_advancement()
       self.advance()
 
-      body = res.register(self.expr())
-      if res.error: return res
-
-      return res.success(FuncDefNode(
+      return FuncDefNode(
         var_name_tok,
         arg_name_toks,
-        body,
+        self.expr(),
         True
-      ))
+      )
     
     if self.current_tok.type != TT_NEWLINE:
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected '->' or NEWLINE"
-      ))
+      raise self.invalid_syntax(f"Expected '->' or NEWLINE")
 
-    res.register_advancement()
     self.advance()
 
-    body = res.register(self.statements())
-    if res.error: return res
+    if self.lazy:
+      body = self.skip_body()
+      if body: return FuncDefNode(var_name_tok, arg_name_toks, body, False)
+
+    body = self.statements()
 
     if not self.current_tok.matches(TT_KEYWORD, 'END'):
-      return res.failure(InvalidSyntaxError(
-        self.current_tok.pos_start, self.current_tok.pos_end,
-        f"Expected 'END'"
-      ))
+      raise self.invalid_syntax(f"Expected 'END'")
 
-    res.register_advancement()
     self.advance()
     
-    return res.success(FuncDefNode(
+    return FuncDefNode(
       var_name_tok,
       arg_name_toks,
       body,
       False
-    ))
+    )
 
-  ###################################
+  def skip_body(self):
+    # Collects the tokens of a FUN body up to its END without building any
+    # nodes. A THEN, ELSE or FUN header followed by NEWLINE opens a block,
+    # and END closes one, as does an ELIF or ELSE that no single-line IF on
+    # its line is waiting for
+    tokens = []
+    blocks = []
+    headers = []
+    line_ifs = 0
+    opens_block = opens_line_if = in_header = False
 
-  def bin_op(self, func_a, ops, func_b=None):
-    if func_b == None:
-      func_b = func_a
-    
-    res = ParseResult()
-    left = res.register(func_a())
-    if res.error: return res
+    while True:
+      tok = self.current_tok
+      if tok.type == TT_EOF:
+        # The body is never closed, so it is parsed for the error it has
+        self.tokens = iter(tokens + [tok])
+        self.advance()
+        return None
 
-    while self.current_tok.type in ops or (self.current_tok.type, self.current_tok.value) in ops:
-      op_tok = self.current_tok
-      res.register_advancement()
+      tokens.append(tok)
       self.advance()
-      right = res.register(func_b())
-      if res.error: return res
-      left = BinOpNode(left, op_tok, right)
 
-    return res.success(left)
+      if tok.type == TT_NEWLINE:
+        if opens_block: blocks.append(line_ifs)
+        line_ifs = 0
+      elif opens_line_if:
+        line_ifs += 1
+
+      opens_block = opens_line_if = False
+      if tok.type == TT_RPAREN and in_header:
+        opens_block, in_header = True, False
+      elif tok.type != TT_KEYWORD:
+        continue
+
+      if tok.value == 'END':
+        if not blocks: return LazyBodyNode(tokens)
+        line_ifs = blocks.pop()
+      elif tok.value in ('IF', 'ELIF', 'FOR', 'WHILE'):
+        headers.append(tok.value)
+      elif tok.value == 'THEN':
+        opens_block = True
+        opens_line_if = bool(headers) and headers.pop() in ('IF', 'ELIF')
+      elif tok.value == 'FUN':
+        in_header = True
+
+      if tok.value in ('ELIF', 'ELSE'):
+        if line_ifs: line_ifs -= 1
+        elif blocks: line_ifs = blocks.pop()
+        opens_block = tok.value == 'ELSE'
+
+  def parse_body(self):
+    # Parses the tokens skip_body collected for a LazyBodyNode
+    try:
+      node = self.statements()
+      if not self.current_tok.matches(TT_KEYWORD, 'END'):
+        raise self.invalid_syntax("Expected 'END'")
+    except ParseException as e:
+      return ParseResult(error=e.error)
+    return ParseResult(node)
 
 #######################################
-# RUNTIME RESULT
+# RESOLVER
 #######################################
 
-class RTResult:
+class Scope:
+  def __init__(self, parent=None):
+    self.parent = parent
+    self.slot_names = []
+    self.slots = {}
+
+  def declare(self, name):
+    if name not in self.slots:
+      self.slots[name] = len(self.slot_names)
+      self.slot_names.append(name)
+
+class Resolver:
+  # Every function body gets a Scope whose slots are its parameters and the
+  # names it binds with VAR, FOR and FUN. Each access is resolved to the
+  # lexical (depth, slot) that defines it, with depth counted in function
+  # scopes and slot None meaning the top-level symbol table. Calls link a
+  # frame to its caller's, so a resolution is only a guess that the
+  # interpreter checks against the frames it actually finds.
   def __init__(self):
-    self.reset()
+    self.scope = None
+
+  def resolve(self, node):
+    if isinstance(node, VarAccessNode):
+      self.resolve_access(node)
+    elif isinstance(node, (VarAssignNode, ForNode)):
+      self.resolve_binding(node, node.var_name_tok.value)
+    elif isinstance(node, FuncDefNode):
+      if node.var_name_tok:
+        self.resolve_binding(node, node.var_name_tok.value)
+      return self.resolve_function(node)
+
+    for child in child_nodes(node):
+      self.resolve(child)
+
+  def resolve_access(self, node):
+    var_name = node.var_name_tok.value
+    scopes = []
+    scope = self.scope
+
+    while scope:
+      scopes.append(scope)
+      if var_name in scope.slots:
+        node.scopes = tuple(scopes)
+        node.depth, node.slot = len(scopes) - 1, scope.slots[var_name]
+        return
+      scope = scope.parent
+
+    scopes.append(None)
+    node.scopes = tuple(scopes)
+    node.depth, node.slot = len(scopes) - 1, None
+
+  def resolve_binding(self, node, var_name):
+    node.scope = self.scope
+    node.slot = self.scope.slots[var_name] if self.scope else None
+
+  def resolve_function(self, node):
+    scope = Scope(self.scope)
+    for arg_name_tok in node.arg_name_toks:
+      scope.declare(arg_name_tok.value)
+    node.body_scope = scope
+
+    # A body that is not parsed yet is resolved when it is loaded
+    if not isinstance(node.body_node, LazyBodyNode):
+      self.resolve_body(node.body_node, scope)
+
+  def resolve_body(self, node, scope):
+    self.declare(node, scope)
+    previous_scope = self.scope
+    self.scope = scope
+    self.resolve(node)
+    self.scope = previous_scope
+
+  def declare(self, node, scope):
+    if isinstance(node, (VarAssignNode, ForNode)):
+      scope.declare(node.var_name_tok.value)
+    elif isinstance(node, FuncDefNode):
+      if node.var_name_tok:
+        scope.declare(node.var_name_tok.value)
+      return
+
+    for child in child_nodes(node):
+      self.declare(child, scope)
+
+def mark_result_usage(node, result_used=True):
+  # Flags every node with whether anything reads its value. Statement lists
+  # whose value is dropped, and loops that would collect into such a list,
+  # can then skip building a List
+  node.result_used = result_used
+
+  if isinstance(node, (ForNode, WhileNode)):
+    for child in child_nodes(node)[:-1]:
+      mark_result_usage(child)
+    mark_result_usage(node.body_node, collects_results(node))
+  elif isinstance(node, IfNode):
+    for condition, expr, should_return_null in node.cases:
+      mark_result_usage(condition)
+      mark_result_usage(expr, result_used and not should_return_null)
+    if node.else_case:
+      expr, should_return_null = node.else_case
+      mark_result_usage(expr, result_used and not should_return_null)
+  elif isinstance(node, FuncDefNode):
+    mark_result_usage(node.body_node, node.should_auto_return)
+  elif isinstance(node, ListNode):
+    for element_node in node.element_nodes:
+      mark_result_usage(element_node, result_used)
+  else:
+    for child in child_nodes(node):
+      mark_result_usage(child)
+
+def collects_results(node):
+  return node.result_used and not node.should_return_null
+
+def mark_tail_calls(node, in_function=False, is_tail=False):
+  # A call is in tail position when its value becomes the result of the
+  # function around it: the body of an arrow function, the value of a
+  # RETURN, and value-returning IF branches in either of those
+  if isinstance(node, CallNode):
+    node.is_tail_call = is_tail
+    for child in child_nodes(node):
+      mark_tail_calls(child, in_function)
+  elif isinstance(node, FuncDefNode):
+    mark_tail_calls(node.body_node, True, node.should_auto_return)
+  elif isinstance(node, ReturnNode):
+    if node.node_to_return:
+      mark_tail_calls(node.node_to_return, in_function, in_function)
+  elif isinstance(node, IfNode):
+    for condition, expr, should_return_null in node.cases:
+      mark_tail_calls(condition, in_function)
+      mark_tail_calls(expr, in_function, is_tail and not should_return_null)
+    if node.else_case:
+      expr, should_return_null = node.else_case
+      mark_tail_calls(expr, in_function, is_tail and not should_return_null)
+  else:
+    for child in child_nodes(node):
+      mark_tail_calls(child, in_function)
 
-  def reset(self):
-    self.value = None
-    self.error = None
-    self.func_return_value = None
-    self.loop_should_continue = False
-    self.loop_should_break = False
-
-  def register(self, res):
-    self.error = res.error
-    self.func_return_value = res.func_return_value
-    self.loop_should_continue = res.loop_should_continue
-    self.loop_should_break = res.loop_should_break
-    return res.value
-
-  def success(self, value):
-    self.reset()
-    self.value = value
-    return self
+#######################################
+# OPTIMIZER
+#######################################
 
-  def success_return(self, value):
-    self.reset()
-    self.func_return_value = value
-    return self
-  
-  def success_continue(self):
-    self.reset()
-    self.loop_should_continue = True
-    return self
+# Folding never builds a string longer than this, or raises to a larger power
+MAX_FOLDED_STRING = 1024
+MAX_FOLDED_EXPONENT = 1024
+
+class Optimizer:
+  # Folds constant subtrees and IF cases, and replaces reads of names that
+  # provably hold a constant. Operations that fail are left in place to
+  # fail at runtime. Every node it returns is a copy: the passes after it
+  # annotate the tree in place, and the tree the parser returned is shared
+  # by every run of the same text through the parse cache.
+  def __init__(self, symbol_table):
+    self.symbol_table = symbol_table
+    self.constants = {}
+
+  def optimize_program(self, node):
+    bindings = {}
+    accesses = set()
+    self.scan(node, bindings, accesses)
+    closed = not accesses & {'RUN', 'IMPORT'} and all(
+      self.is_plain_value(self.symbol_table.get(name)) for name in accesses
+    )
 
-  def success_break(self):
-    self.reset()
-    self.loop_should_break = True
-    return self
+    if not isinstance(node, ListNode):
+      return self.optimize(node)
 
-  def failure(self, error):
-    self.reset()
-    self.error = error
-    return self
+    statements = []
+    for statement in node.element_nodes:
+      statement = self.optimize(statement)
+      statements.append(statement)
 
-  def should_return(self):
-    # Note: this will allow you to continue and break outside the current function
-    return (
-      self.error or
-      self.func_return_value or
-      self.loop_should_continue or
-      self.loop_should_break
-    )
+      # A top-level VAR that is the name's only binding holds its value for
+      # every statement after it. The globals may change once the program
+      # ends, so values are never taken from them
+      if closed and isinstance(statement, VarAssignNode):
+        name = statement.var_name_tok.value
+        if bindings[name] == 1 and self.is_constant(statement.value_node):
+          self.constants[name] = statement.value_node.tok.value
+
+    return self.replace(node, element_nodes=statements)
+
+  def scan(self, node, bindings, accesses):
+    names = []
+    if isinstance(node, VarAccessNode):
+      accesses.add(node.var_name_tok.value)
+    elif isinstance(node, (VarAssignNode, ForNode)):
+      names.append(node.var_name_tok.value)
+    elif isinstance(node, FuncDefNode):
+      if node.var_name_tok: names.append(node.var_name_tok.value)
+      names.extend(arg_name_tok.value for arg_name_tok in node.arg_name_toks)
+    elif isinstance(node, LazyBodyNode):
+      # Any name in a body that is not parsed yet may be bound or read there
+      names.extend(tok.value for tok in node.tokens if tok.type == TT_IDENTIFIER)
+      accesses.update(names)
+
+    for name in names:
+      bindings[name] = bindings.get(name, 0) + 1
+    for child in child_nodes(node):
+      self.scan(child, bindings, accesses)
+
+  def is_plain_value(self, value):
+    # Anything reachable from the program must not run code it cannot see
+    if isinstance(value, List):
+      return all(self.is_plain_value(element) for element in value.elements)
+    if isinstance(value, BuiltInFunction):
+      return value.name not in ('run', 'import')
+    return not isinstance(value, BaseFunction)
+
+  def is_constant(self, node):
+    return isinstance(node, (NumberNode, StringNode))
+
+  def constant_value(self, node):
+    return node.constant
+
+  def constant_node(self, value, node):
+    if isinstance(value, String):
+      if len(value.value) > MAX_FOLDED_STRING: return None
+      return self.literal_node(TT_STRING, value.value, node)
+
+    if isinstance(value, Number):
+      if type(value.value) == int:
+        return self.literal_node(TT_INT, value.value, node)
+      if type(value.value) == float:
+        return self.literal_node(TT_FLOAT, value.value, node)
+
+    return None
+
+  def literal_node(self, tok_type, value, node):
+    # The literal keeps the exact positions of the expression it replaces
+    tok = Token(tok_type, value, node.pos_start.idx, node.pos_end.idx, node.pos_start.source)
+    literal = StringNode(tok) if tok_type == TT_STRING else NumberNode(tok)
+    literal.pos_start = node.pos_start
+    literal.pos_end = node.pos_end
+    return literal
+
+  def replace(self, old_node, **fields):
+    new_node = copy_node(old_node)
+    for name, value in fields.items():
+      setattr(new_node, name, value)
+    return new_node
 
-#######################################
+  ###################################
+
+  def optimize(self, node):
+    method_name = f'optimize_{type(node).__name__}'
+    method = getattr(self, method_name, None)
+    return method(node) if method else copy_node(node)
+
+  ###################################
+
+  def optimize_ListNode(self, node):
+    return self.replace(node, element_nodes=[self.optimize(element_node) for element_node in node.element_nodes])
+
+  def optimize_VarAccessNode(self, node):
+    var_name = node.var_name_tok.value
+    if var_name not in self.constants: return copy_node(node)
+
+    value = self.constants[var_name]
+    tok_type = TT_STRING if type(value) == str else TT_FLOAT if type(value) == float else TT_INT
+    return self.literal_node(tok_type, value, node)
+
+  def optimize_VarAssignNode(self, node):
+    return self.replace(node, value_node=self.optimize(node.value_node))
+
+  def optimize_BinOpNode(self, node):
+    left_node = self.optimize(node.left_node)
+    if self.is_constant(left_node) and node.op_tok.type == TT_KEYWORD:
+      result = self.constant_value(left_node).short_circuit(node.op_tok.value)
+      if result: return self.constant_node(result, node)
+
+    right_node = self.optimize(node.right_node)
+    node = self.replace(node, left_node=left_node, right_node=right_node)
+    if not self.is_constant(left_node) or not self.is_constant(right_node): return node
+
+    method_name = binary_op_method(node.op_tok)
+    left, right = self.constant_value(left_node), self.constant_value(right_node)
+    if method_name == 'powed_by' and isinstance(right.value, int) and abs(right.value) > MAX_FOLDED_EXPONENT:
+      return node
+
+    # Operations that fail are left to fail at runtime
+    try:
+      result = getattr(left, method_name)(right)
+    except Exception:
+      return node
+
+    return self.constant_node(result, node) or node
+
+  def optimize_UnaryOpNode(self, node):
+    operand_node = self.optimize(node.node)
+    node = self.replace(node, node=operand_node)
+    if not self.is_constant(operand_node): return node
+
+    operand = self.constant_value(operand_node)
+    try:
+      if node.op_tok.type == TT_MINUS:
+        result = operand.multed_by(Number.minus_one)
+      elif node.op_tok.matches(TT_KEYWORD, 'NOT'):
+        result = operand.notted()
+      else:
+        result = operand
+    except Exception:
+      return node
+
+    return self.constant_node(result, node) or node
+
+  def optimize_IfNode(self, node):
+    cases = []
+    else_case = None
+
+    for condition, expr, should_return_null in node.cases:
+      condition = self.optimize(condition)
+      if not self.is_constant(condition):
+        cases.append((condition, self.optimize(expr), should_return_null))
+      elif self.constant_value(condition).is_true():
+        else_case = (self.optimize(expr), should_return_null)
+        break
+    else:
+      if node.else_case:
+        else_case = (self.optimize(node.else_case[0]), node.else_case[1])
+
+    if not cases and else_case and not else_case[1]:
+      return else_case[0]
+
+    new_node = copy_node(node)
+    new_node.cases = cases
+    new_node.else_case = else_case
+    return new_node
+
+  def optimize_ForNode(self, node):
+    return self.replace(
+      node,
+      start_value_node=self.optimize(node.start_value_node),
+      end_value_node=self.optimize(node.end_value_node),
+      step_value_node=node.step_value_node and self.optimize(node.step_value_node),
+      body_node=self.optimize(node.body_node)
+    )
+
+  def optimize_WhileNode(self, node):
+    return self.replace(
+      node,
+      condition_node=self.optimize(node.condition_node),
+      body_node=self.optimize(node.body_node)
+    )
+
+  def optimize_FuncDefNode(self, node):
+    # A body runs when it is called, maybe after a later program has bound
+    # the names again, so no constants are propagated into it
+    constants, self.constants = self.constants, {}
+    body_node = self.optimize(node.body_node)
+    self.constants = constants
+    return self.replace(node, body_node=body_node)
+
+  def optimize_CallNode(self, node):
+    return self.replace(
+      node,
+      node_to_call=self.optimize(node.node_to_call),
+      arg_nodes=[self.optimize(arg_node) for arg_node in node.arg_nodes]
+    )
+
+  def optimize_ReturnNode(self, node):
+    return self.replace(node, node_to_return=node.node_to_return and self.optimize(node.node_to_return))
+
+#######################################
+# CONTROL FLOW SIGNALS
+#######################################
+
+class RTException(Exception):
+  def __init__(self, error):
+    super().__init__(error.details)
+    self.error = error
+
+class ReturnException(Exception):
+  def __init__(self, value):
+    super().__init__()
+    self.value = value
+
+class BreakException(Exception):
+  pass
+
+class ContinueException(Exception):
+  pass
+
+BreakException.instance = BreakException()
+ContinueException.instance = ContinueException()
+
+class TailCall:
+  # Stands in for the value of a call in tail position; the Function.execute
+  # loop that receives it makes the call instead of nesting another one
+  def __init__(self, function, args):
+    self.function = function
+    self.args = args
+
+#######################################
+# VECTORS
+#######################################
+
+# Leaves and inner nodes hold up to 32 entries
+VECTOR_BITS = 5
+VECTOR_WIDTH = 1 << VECTOR_BITS
+VECTOR_MASK = VECTOR_WIDTH - 1
+
+class Vector:
+  # A persistent vector: the elements in order in a trie of 32-way nodes,
+  # except for the last 1 to 32, which are kept in a separate tail. Updates
+  # copy the path they change and share the rest of the trie, so a new
+  # version costs O(log32 n). Only push changes a vector in place, and only
+  # its tail, for a List that owns it.
+  __slots__ = ('count', 'shift', 'root', 'tail')
+
+  def __init__(self, count, shift, root, tail):
+    self.count = count
+    self.shift = shift
+    self.root = root
+    self.tail = tail
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self, index):
+    if index < 0: index += self.count
+    if not 0 <= index < self.count:
+      raise IndexError('vector index out of range')
+
+    tail_offset = self.count - len(self.tail)
+    if index >= tail_offset:
+      return self.tail[index - tail_offset]
+    return self.leaf_for(index)[index & VECTOR_MASK]
+
+  def __iter__(self):
+    for start in range(0, self.count - len(self.tail), VECTOR_WIDTH):
+      yield from self.leaf_for(start)
+    yield from self.tail
+
+  def leaf_for(self, index):
+    node = self.root
+    level = self.shift
+    while level > 0:
+      node = node[(index >> level) & VECTOR_MASK]
+      level -= VECTOR_BITS
+    return node
+
+  def transient(self):
+    # A version with a tail of its own, which push can then grow in place
+    return Vector(self.count, self.shift, self.root, self.tail[:])
+
+  def push(self, value):
+    if len(self.tail) < VECTOR_WIDTH:
+      self.tail.append(value)
+    else:
+      self.push_tail()
+      self.tail = [value]
+    self.count += 1
+
+  def push_tail(self):
+    # Moves the full tail into the trie, adding a level when the root is full
+    if (self.count >> VECTOR_BITS) > (1 << self.shift):
+      self.root = [self.root, vector_path(self.shift, self.tail)]
+      self.shift += VECTOR_BITS
+    else:
+      self.root = vector_push_leaf(self.shift, self.root, self.tail, self.count)
+
+  def appended(self, value):
+    vector = self.transient()
+    vector.push(value)
+    return vector
+
+  def extended(self, values):
+    vector = self.transient()
+    for value in values:
+      vector.push(value)
+    return vector
+
+  def removed(self, index):
+    if type(index) is int and self.count and index in (-1, self.count - 1):
+      return self.popped()
+
+    # Removing from the middle shifts every element after it
+    elements = list(self)
+    elements.pop(index)
+    return make_vector(elements)
+
+  def popped(self):
+    if len(self.tail) > 1 or self.count == 1:
+      return Vector(self.count - 1, self.shift, self.root, self.tail[:-1])
+
+    # The last leaf of the trie becomes the tail
+    tail = self.leaf_for(self.count - 2)
+    root = vector_pop_leaf(self.shift, self.root)
+    shift = self.shift
+    while shift > VECTOR_BITS and len(root) == 1:
+      root = root[0]
+      shift -= VECTOR_BITS
+    return Vector(self.count - 1, shift, root, tail[:])
+
+def vector_path(level, node):
+  while level > 0:
+    node = [node]
+    level -= VECTOR_BITS
+  return node
+
+def vector_push_leaf(level, node, leaf, count):
+  # The trie is filled from the left, so the new leaf goes down the rightmost
+  # path, copying it
+  new_node = node[:]
+  if level == VECTOR_BITS:
+    new_node.append(leaf)
+  elif ((count - 1) >> level) & VECTOR_MASK < len(node):
+    new_node[-1] = vector_push_leaf(level - VECTOR_BITS, node[-1], leaf, count)
+  else:
+    new_node.append(vector_path(level - VECTOR_BITS, leaf))
+  return new_node
+
+def vector_pop_leaf(level, node):
+  if level > VECTOR_BITS:
+    child = vector_pop_leaf(level - VECTOR_BITS, node[-1])
+    if child: return node[:-1] + [child]
+  return node[:-1]
+
+def make_vector(elements):
+  # Takes over the list it is given, which becomes the tail or is cut into
+  # the leaves
+  if len(elements) <= VECTOR_WIDTH:
+    return Vector(len(elements), VECTOR_BITS, [], elements)
+
+  tail_offset = (len(elements) - 1) & ~VECTOR_MASK
+  nodes = [elements[i:i + VECTOR_WIDTH] for i in range(0, tail_offset, VECTOR_WIDTH)]
+  shift = VECTOR_BITS
+  while len(nodes) > VECTOR_WIDTH:
+    nodes = [nodes[i:i + VECTOR_WIDTH] for i in range(0, len(nodes), VECTOR_WIDTH)]
+    shift += VECTOR_BITS
+  return Vector(len(elements), shift, nodes, elements[tail_offset:])
+
+#######################################
 # VALUES
 #######################################
 
 class Value:
+  # Where a value was evaluated, for the errors it raises. Numbers and
+  # strings are immutable and shared, so they never get one: interpreters
+  # report their errors from the evaluating node through operation_error
+  __slots__ = ('pos_start', 'pos_end', 'context')
+
   def __init__(self):
     self.set_pos()
     self.set_context()
@@ -1324,49 +1725,53 @@ class Value:
     return self
 
   def added_to(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def subbed_by(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def multed_by(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def dived_by(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def powed_by(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def get_comparison_eq(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def get_comparison_ne(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def get_comparison_lt(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def get_comparison_gt(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def get_comparison_lte(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def get_comparison_gte(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def anded_by(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def ored_by(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
 
   def notted(self, other):
-    return None, self.illegal_operation(other)
+    raise RTException(self.illegal_operation(other))
+
+  def short_circuit(self, keyword):
+    # Result of AND / OR when it does not depend on the right operand
+    return None
 
   def execute(self, args):
-    return RTResult().failure(self.illegal_operation())
+    raise RTException(self.illegal_operation())
 
   def copy(self):
     raise Exception('No copy method defined')
@@ -1383,97 +1788,104 @@ class Value:
     )
 
 class Number(Value):
+  __slots__ = ('value',)
+
   def __init__(self, value):
-    super().__init__()
     self.value = value
+    self.pos_start = self.pos_end = self.context = None
 
   def added_to(self, other):
     if isinstance(other, Number):
-      return Number(self.value + other.value).set_context(self.context), None
+      return make_number(self.value + other.value)
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def subbed_by(self, other):
     if isinstance(other, Number):
-      return Number(self.value - other.value).set_context(self.context), None
+      return make_number(self.value - other.value)
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def multed_by(self, other):
     if isinstance(other, Number):
-      return Number(self.value * other.value).set_context(self.context), None
+      return make_number(self.value * other.value)
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def dived_by(self, other):
     if isinstance(other, Number):
       if other.value == 0:
-        return None, RTError(
+        raise RTException(RTError(
           other.pos_start, other.pos_end,
           'Division by zero',
           self.context
-        )
+        ))
 
-      return Number(self.value / other.value).set_context(self.context), None
+      return Number(self.value / other.value)
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def powed_by(self, other):
     if isinstance(other, Number):
-      return Number(self.value ** other.value).set_context(self.context), None
+      return make_number(self.value ** other.value)
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def get_comparison_eq(self, other):
     if isinstance(other, Number):
-      return Number(int(self.value == other.value)).set_context(self.context), None
+      return Number.true if self.value == other.value else Number.false
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def get_comparison_ne(self, other):
     if isinstance(other, Number):
-      return Number(int(self.value != other.value)).set_context(self.context), None
+      return Number.true if self.value != other.value else Number.false
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def get_comparison_lt(self, other):
     if isinstance(other, Number):
-      return Number(int(self.value < other.value)).set_context(self.context), None
+      return Number.true if self.value < other.value else Number.false
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def get_comparison_gt(self, other):
     if isinstance(other, Number):
-      return Number(int(self.value > other.value)).set_context(self.context), None
+      return Number.true if self.value > other.value else Number.false
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def get_comparison_lte(self, other):
     if isinstance(other, Number):
-      return Number(int(self.value <= other.value)).set_context(self.context), None
+      return Number.true if self.value <= other.value else Number.false
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def get_comparison_gte(self, other):
     if isinstance(other, Number):
-      return Number(int(self.value >= other.value)).set_context(self.context), None
+      return Number.true if self.value >= other.value else Number.false
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def anded_by(self, other):
     if isinstance(other, Number):
-      return Number(int(self.value and other.value)).set_context(self.context), None
+      return make_number(int(self.value and other.value))
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def ored_by(self, other):
     if isinstance(other, Number):
-      return Number(int(self.value or other.value)).set_context(self.context), None
+      return make_number(int(self.value or other.value))
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def notted(self):
-    return Number(1 if self.value == 0 else 0).set_context(self.context), None
+    return Number.true if self.value == 0 else Number.false
+
+  def short_circuit(self, keyword):
+    if (keyword == 'AND' and not self.value) or (keyword == 'OR' and self.value):
+      return make_number(int(self.value))
+    return None
 
   def copy(self):
     copy = Number(self.value)
@@ -1490,27 +1902,87 @@ class Number(Value):
   def __repr__(self):
     return str(self.value)
 
+# Integers in this range are made once and shared, like CPython's
+SMALL_INT_MIN = -5
+SMALL_INT_MAX = 256
+SMALL_NUMBERS = [Number(i) for i in range(SMALL_INT_MIN, SMALL_INT_MAX + 1)]
+
+def make_number(value):
+  if type(value) is int and SMALL_INT_MIN <= value <= SMALL_INT_MAX:
+    return SMALL_NUMBERS[value - SMALL_INT_MIN]
+  return Number(value)
+
 Number.null = Number(0)
-Number.false = Number(0)
-Number.true = Number(1)
+Number.false = make_number(0)
+Number.true = make_number(1)
+Number.minus_one = make_number(-1)
 Number.math_PI = Number(math.pi)
 
+# Concatenations that reach this length defer their copying to a builder
+STRING_BUILDER_MIN = 64
+
+class StringBuilder:
+  # The pieces of a run of concatenations, which the strings built by it
+  # share. A string is the first piece_count pieces, so only the string made
+  # last can add to the run without copying. The longest prefix joined so
+  # far is kept for the next string that is read
+  __slots__ = ('pieces', 'joined', 'joined_count')
+
+  def __init__(self, text):
+    self.pieces = [text]
+    self.joined = text
+    self.joined_count = 1
+
+  def join(self, piece_count):
+    if piece_count < self.joined_count:
+      return ''.join(self.pieces[:piece_count])
+
+    self.joined += ''.join(self.pieces[self.joined_count:piece_count])
+    self.joined_count = piece_count
+    return self.joined
+
 class String(Value):
+  # A string made by concatenation may be a run of pieces in a builder, and
+  # is only joined into one Python str once its value is read
+  __slots__ = ('text', 'builder', 'piece_count')
+
   def __init__(self, value):
-    super().__init__()
-    self.value = value
+    self.text = value
+    self.builder = None
+    self.pos_start = self.pos_end = self.context = None
+
+  @property
+  def value(self):
+    if self.text is None:
+      self.text = self.builder.join(self.piece_count)
+      self.builder = None
+    return self.text
 
   def added_to(self, other):
     if isinstance(other, String):
-      return String(self.value + other.value).set_context(self.context), None
+      return self.concatenated(other.value)
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
+
+  def concatenated(self, text):
+    builder = self.builder
+    if builder is None or len(builder.pieces) != self.piece_count:
+      value = self.value
+      if len(value) + len(text) < STRING_BUILDER_MIN:
+        return String(value + text)
+      builder = StringBuilder(value)
+
+    builder.pieces.append(text)
+    string = String(None)
+    string.builder = builder
+    string.piece_count = len(builder.pieces)
+    return string
 
   def multed_by(self, other):
     if isinstance(other, Number):
-      return String(self.value * other.value).set_context(self.context), None
+      return String(self.value * other.value)
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def is_true(self):
     return len(self.value) > 0
@@ -1528,53 +2000,70 @@ class String(Value):
     return f'"{self.value}"'
 
 class List(Value):
+  # The elements are a Vector, so +, - and * make new lists that share most
+  # of it. APPEND and EXTEND change the list itself, growing the vector's
+  # tail in place while no other List shares the vector
+  __slots__ = ('elements', 'owns_elements')
+
   def __init__(self, elements):
     super().__init__()
-    self.elements = elements
+    self.elements = make_vector(elements) if type(elements) is list else elements
+    self.owns_elements = True
+
+  def append(self, value):
+    if not self.owns_elements:
+      self.elements = self.elements.transient()
+      self.owns_elements = True
+    self.elements.push(value)
+
+  def extend(self, values):
+    self.elements = self.elements.extended(values)
+    self.owns_elements = True
+
+  def pop(self, index):
+    element = self.elements[index]
+    self.elements = self.elements.removed(index)
+    self.owns_elements = True
+    return element
 
   def added_to(self, other):
-    new_list = self.copy()
-    new_list.elements.append(other)
-    return new_list, None
+    return List(self.elements.appended(other))
 
   def subbed_by(self, other):
     if isinstance(other, Number):
-      new_list = self.copy()
       try:
-        new_list.elements.pop(other.value)
-        return new_list, None
+        return List(self.elements.removed(other.value))
       except:
-        return None, RTError(
+        raise RTException(RTError(
           other.pos_start, other.pos_end,
           'Element at this index could not be removed from list because index is out of bounds',
           self.context
-        )
+        ))
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def multed_by(self, other):
     if isinstance(other, List):
-      new_list = self.copy()
-      new_list.elements.extend(other.elements)
-      return new_list, None
+      return List(self.elements.extended(other.elements))
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
 
   def dived_by(self, other):
     if isinstance(other, Number):
       try:
-        return self.elements[other.value], None
+        return self.elements[other.value]
       except:
-        return None, RTError(
+        raise RTException(RTError(
           other.pos_start, other.pos_end,
           'Element at this index could not be retrieved from list because index is out of bounds',
           self.context
-        )
+        ))
     else:
-      return None, Value.illegal_operation(self, other)
+      raise RTException(Value.illegal_operation(self, other))
   
   def copy(self):
     copy = List(self.elements)
+    self.owns_elements = copy.owns_elements = False
     copy.set_pos(self.pos_start, self.pos_end)
     copy.set_context(self.context)
     return copy
@@ -1586,6 +2075,8 @@ class List(Value):
     return f'[{", ".join([repr(x) for x in self.elements])}]'
 
 class BaseFunction(Value):
+  __slots__ = ('name',)
+
   def __init__(self, name):
     super().__init__()
     self.name = name or "<anonymous>"
@@ -1596,61 +2087,90 @@ class BaseFunction(Value):
     return new_context
 
   def check_args(self, arg_names, args):
-    res = RTResult()
-
     if len(args) > len(arg_names):
-      return res.failure(RTError(
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
         f"{len(args) - len(arg_names)} too many args passed into {self}",
         self.context
       ))
     
     if len(args) < len(arg_names):
-      return res.failure(RTError(
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
         f"{len(arg_names) - len(args)} too few args passed into {self}",
         self.context
       ))
 
-    return res.success(None)
-
   def populate_args(self, arg_names, args, exec_ctx):
     for i in range(len(args)):
-      arg_name = arg_names[i]
-      arg_value = args[i]
-      arg_value.set_context(exec_ctx)
-      exec_ctx.symbol_table.set(arg_name, arg_value)
+      exec_ctx.symbol_table.set(arg_names[i], args[i])
 
   def check_and_populate_args(self, arg_names, args, exec_ctx):
-    res = RTResult()
-    res.register(self.check_args(arg_names, args))
-    if res.should_return(): return res
+    self.check_args(arg_names, args)
     self.populate_args(arg_names, args, exec_ctx)
-    return res.success(None)
+
+  def recursion_error(self):
+    # Python ran out of stack inside this call. The error is made where the
+    # call was, so its traceback shows the calls that led there
+    return RTException(RTError(
+      self.pos_start, self.pos_end,
+      "Maximum recursion depth exceeded",
+      self.context
+    ))
 
 class Function(BaseFunction):
-  def __init__(self, name, body_node, arg_names, should_auto_return):
+  __slots__ = ('body_node', 'arg_names', 'should_auto_return', 'scope')
+
+  def __init__(self, name, body_node, arg_names, should_auto_return, scope=None):
     super().__init__(name)
     self.body_node = body_node
     self.arg_names = arg_names
     self.should_auto_return = should_auto_return
+    self.scope = scope
+
+  def generate_new_context(self):
+    if not self.scope: return super().generate_new_context()
+    new_context = Context(self.name, self.context, self.pos_start)
+    new_context.symbol_table = Frame(self.scope, new_context.parent.symbol_table)
+    return new_context
+
+  def load_body(self):
+    if type(self.body_node) is LazyBodyNode:
+      self.body_node = self.body_node.load(self.scope)
 
   def execute(self, args):
-    res = RTResult()
     interpreter = Interpreter()
+    function = self
+    self.load_body()
     exec_ctx = self.generate_new_context()
+    self.check_and_populate_args(self.arg_names, args, exec_ctx)
 
-    res.register(self.check_and_populate_args(self.arg_names, args, exec_ctx))
-    if res.should_return(): return res
-
-    value = res.register(interpreter.visit(self.body_node, exec_ctx))
-    if res.should_return() and res.func_return_value == None: return res
-
-    ret_value = (value if self.should_auto_return else None) or res.func_return_value or Number.null
-    return res.success(ret_value)
+    while True:
+      try:
+        value = interpreter.visit(function.body_node, exec_ctx)
+        if not function.should_auto_return: value = Number.null
+      except ReturnException as e:
+        value = e.value
+      except RecursionError:
+        raise self.recursion_error()
+
+      if type(value) is not TailCall: return value
+      function, exec_ctx = function.tail_call(value, exec_ctx)
+
+  def tail_call(self, tail_call, exec_ctx):
+    callee = tail_call.function
+    callee.load_body()
+
+    # A function calling itself would link a new frame of the same scope
+    # to this one. Lookups would find the newest value of each name either
+    # way, so the frame is reused
+    if not (callee.body_node is self.body_node and callee.context is exec_ctx and callee.scope):
+      exec_ctx = callee.generate_new_context()
+    callee.check_and_populate_args(callee.arg_names, tail_call.args, exec_ctx)
+    return callee, exec_ctx
 
   def copy(self):
-    copy = Function(self.name, self.body_node, self.arg_names, self.should_auto_return)
+    copy = Function(self.name, self.body_node, self.arg_names, self.should_auto_return, self.scope)
     copy.set_context(self.context)
     copy.set_pos(self.pos_start, self.pos_end)
     return copy
@@ -1659,22 +2179,19 @@ class Function(BaseFunction):
     return f"<function {self.name}>"
 
 class BuiltInFunction(BaseFunction):
+  __slots__ = ()
+
   def __init__(self, name):
     super().__init__(name)
 
   def execute(self, args):
-    res = RTResult()
     exec_ctx = self.generate_new_context()
 
     method_name = f'execute_{self.name}'
     method = getattr(self, method_name, self.no_visit_method)
 
-    res.register(self.check_and_populate_args(method.arg_names, args, exec_ctx))
-    if res.should_return(): return res
-
-    return_value = res.register(method(exec_ctx))
-    if res.should_return(): return res
-    return res.success(return_value)
+    self.check_and_populate_args(method.arg_names, args, exec_ctx)
+    return method(exec_ctx)
   
   def no_visit_method(self, node, context):
     raise Exception(f'No execute_{self.name} method defined')
@@ -1692,16 +2209,16 @@ class BuiltInFunction(BaseFunction):
 
   def execute_print(self, exec_ctx):
     print(str(exec_ctx.symbol_table.get('value')))
-    return RTResult().success(Number.null)
+    return Number.null
   execute_print.arg_names = ['value']
   
   def execute_print_ret(self, exec_ctx):
-    return RTResult().success(String(str(exec_ctx.symbol_table.get('value'))))
+    return String(str(exec_ctx.symbol_table.get('value')))
   execute_print_ret.arg_names = ['value']
   
   def execute_input(self, exec_ctx):
     text = input()
-    return RTResult().success(String(text))
+    return String(text)
   execute_input.arg_names = []
 
   def execute_input_int(self, exec_ctx):
@@ -1712,32 +2229,32 @@ class BuiltInFunction(BaseFunction):
         break
       except ValueError:
         print(f"'{text}' must be an integer. Try again!")
-    return RTResult().success(Number(number))
+    return make_number(number)
   execute_input_int.arg_names = []
 
   def execute_clear(self, exec_ctx):
     os.system('cls' if os.name == 'nt' else 'cls') 
-    return RTResult().success(Number.null)
+    return Number.null
   execute_clear.arg_names = []
 
   def execute_is_number(self, exec_ctx):
     is_number = isinstance(exec_ctx.symbol_table.get("value"), Number)
-    return RTResult().success(Number.true if is_number else Number.false)
+    return Number.true if is_number else Number.false
   execute_is_number.arg_names = ["value"]
 
   def execute_is_string(self, exec_ctx):
     is_number = isinstance(exec_ctx.symbol_table.get("value"), String)
-    return RTResult().success(Number.true if is_number else Number.false)
+    return Number.true if is_number else Number.false
   execute_is_string.arg_names = ["value"]
 
   def execute_is_list(self, exec_ctx):
     is_number = isinstance(exec_ctx.symbol_table.get("value"), List)
-    return RTResult().success(Number.true if is_number else Number.false)
+    return Number.true if is_number else Number.false
   execute_is_list.arg_names = ["value"]
 
   def execute_is_function(self, exec_ctx):
     is_number = isinstance(exec_ctx.symbol_table.get("value"), BaseFunction)
-    return RTResult().success(Number.true if is_number else Number.false)
+    return Number.true if is_number else Number.false
   execute_is_function.arg_names = ["value"]
 
   def execute_append(self, exec_ctx):
@@ -1745,14 +2262,14 @@ class BuiltInFunction(BaseFunction):
     value = exec_ctx.symbol_table.get("value")
 
     if not isinstance(list_, List):
-      return RTResult().failure(RTError(
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
         "First argument must be list",
         exec_ctx
       ))
 
-    list_.elements.append(value)
-    return RTResult().success(Number.null)
+    list_.append(value)
+    return Number.null
   execute_append.arg_names = ["list", "value"]
 
   def execute_pop(self, exec_ctx):
@@ -1760,28 +2277,28 @@ class BuiltInFunction(BaseFunction):
     index = exec_ctx.symbol_table.get("index")
 
     if not isinstance(list_, List):
-      return RTResult().failure(RTError(
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
         "First argument must be list",
         exec_ctx
       ))
 
     if not isinstance(index, Number):
-      return RTResult().failure(RTError(
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
         "Second argument must be number",
         exec_ctx
       ))
 
     try:
-      element = list_.elements.pop(index.value)
+      element = list_.pop(index.value)
     except:
-      return RTResult().failure(RTError(
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
         'Element at this index could not be removed from list because index is out of bounds',
         exec_ctx
       ))
-    return RTResult().success(element)
+    return element
   execute_pop.arg_names = ["list", "index"]
 
   def execute_extend(self, exec_ctx):
@@ -1789,41 +2306,169 @@ class BuiltInFunction(BaseFunction):
     listB = exec_ctx.symbol_table.get("listB")
 
     if not isinstance(listA, List):
-      return RTResult().failure(RTError(
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
         "First argument must be list",
         exec_ctx
       ))
 
     if not isinstance(listB, List):
-      return RTResult().failure(RTError(
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
         "Second argument must be list",
         exec_ctx
       ))
 
-    listA.elements.extend(listB.elements)
-    return RTResult().success(Number.null)
+    listA.extend(listB.elements)
+    return Number.null
   execute_extend.arg_names = ["listA", "listB"]
 
   def execute_len(self, exec_ctx):
+    value = exec_ctx.symbol_table.get("value")
+
+    if isinstance(value, List):
+      return make_number(len(value.elements))
+    if isinstance(value, String):
+      return make_number(len(value.value))
+
+    raise RTException(RTError(
+      self.pos_start, self.pos_end,
+      "Argument must be list or string",
+      exec_ctx
+    ))
+  execute_len.arg_names = ["value"]
+
+  # The string builtins work on Python strs directly, instead of the MyOPL
+  # loops over characters that scripts otherwise need
+
+  def execute_join(self, exec_ctx):
     list_ = exec_ctx.symbol_table.get("list")
+    separator = exec_ctx.symbol_table.get("separator")
 
-    if not isinstance(list_, List):
-      return RTResult().failure(RTError(
+    if not isinstance(list_, List) or not all(isinstance(element, String) for element in list_.elements):
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "First argument must be list of strings",
+        exec_ctx
+      ))
+
+    if not isinstance(separator, String):
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "Second argument must be string",
+        exec_ctx
+      ))
+
+    return String(separator.value.join([element.value for element in list_.elements]))
+  execute_join.arg_names = ["list", "separator"]
+
+  def execute_split(self, exec_ctx):
+    string = exec_ctx.symbol_table.get("string")
+    separator = exec_ctx.symbol_table.get("separator")
+
+    if not isinstance(string, String):
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "First argument must be string",
+        exec_ctx
+      ))
+
+    if not isinstance(separator, String) or not separator.value:
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "Second argument must be non-empty string",
+        exec_ctx
+      ))
+
+    return List([String(part) for part in string.value.split(separator.value)])
+  execute_split.arg_names = ["string", "separator"]
+
+  def execute_substr(self, exec_ctx):
+    string = exec_ctx.symbol_table.get("string")
+    start = exec_ctx.symbol_table.get("start")
+    end = exec_ctx.symbol_table.get("end")
+
+    if not isinstance(string, String):
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "First argument must be string",
+        exec_ctx
+      ))
+
+    if not isinstance(start, Number) or type(start.value) is not int:
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "Second argument must be integer",
+        exec_ctx
+      ))
+
+    if not isinstance(end, Number) or type(end.value) is not int:
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "Third argument must be integer",
+        exec_ctx
+      ))
+
+    # Indexes are clamped like Python slices, and count from the end when
+    # negative
+    return String(string.value[start.value:end.value])
+  execute_substr.arg_names = ["string", "start", "end"]
+
+  def execute_find(self, exec_ctx):
+    string = exec_ctx.symbol_table.get("string")
+    substring = exec_ctx.symbol_table.get("substring")
+
+    if not isinstance(string, String):
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "First argument must be string",
+        exec_ctx
+      ))
+
+    if not isinstance(substring, String):
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "Second argument must be string",
+        exec_ctx
+      ))
+
+    return make_number(string.value.find(substring.value))
+  execute_find.arg_names = ["string", "substring"]
+
+  def execute_replace(self, exec_ctx):
+    string = exec_ctx.symbol_table.get("string")
+    old = exec_ctx.symbol_table.get("old")
+    new = exec_ctx.symbol_table.get("new")
+
+    if not isinstance(string, String):
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "First argument must be string",
+        exec_ctx
+      ))
+
+    if not isinstance(old, String):
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "Second argument must be string",
+        exec_ctx
+      ))
+
+    if not isinstance(new, String):
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
-        "Argument must be list",
+        "Third argument must be string",
         exec_ctx
       ))
 
-    return RTResult().success(Number(len(list_.elements)))
-  execute_len.arg_names = ["list"]
+    return String(string.value.replace(old.value, new.value))
+  execute_replace.arg_names = ["string", "old", "new"]
 
   def execute_run(self, exec_ctx):
     fn = exec_ctx.symbol_table.get("fn")
 
     if not isinstance(fn, String):
-      return RTResult().failure(RTError(
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
         "Second argument must be string",
         exec_ctx
@@ -1832,28 +2477,81 @@ class BuiltInFunction(BaseFunction):
     fn = fn.value
 
     try:
-      with open(fn, "r") as f:
-        script = f.read()
+      f = open(fn, "r")
     except Exception as e:
-      return RTResult().failure(RTError(
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
         f"Failed to load script \"{fn}\"\n" + str(e),
         exec_ctx
       ))
 
-    _, error = run(fn, script)
+    with f:
+      _, error = run_file(fn, f, execution_mode)
     
     if error:
-      return RTResult().failure(RTError(
+      raise RTException(RTError(
         self.pos_start, self.pos_end,
         f"Failed to finish executing script \"{fn}\"\n" +
         error.as_string(),
         exec_ctx
       ))
 
-    return RTResult().success(Number.null)
+    return Number.null
   execute_run.arg_names = ["fn"]
 
+  def execute_import(self, exec_ctx):
+    fn = exec_ctx.symbol_table.get("fn")
+
+    if not isinstance(fn, String):
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        "Argument must be string",
+        exec_ctx
+      ))
+
+    fn = fn.value
+
+    try:
+      f = open(fn, "r")
+    except Exception as e:
+      raise RTException(RTError(
+        self.pos_start, self.pos_end,
+        f"Failed to load module \"{fn}\"\n" + str(e),
+        exec_ctx
+      ))
+
+    # A module runs once in its own symbol table, which is reused until the
+    # text of the file changes. It is cached before it runs, so an import
+    # cycle sees the names defined so far instead of running the module again
+    path = os.path.abspath(fn)
+
+    with f:
+      digest = file_digest(f)
+      cached = module_cache.get(path)
+
+      if cached and cached[0] == digest:
+        module = cached[1]
+      else:
+        module = SymbolTable(global_symbol_table)
+        module_cache[path] = (digest, module)
+        _, error = run_file(fn, f, execution_mode, symbol_table=module)
+
+        if error:
+          del module_cache[path]
+          raise RTException(RTError(
+            self.pos_start, self.pos_end,
+            f"Failed to finish executing module \"{fn}\"\n" +
+            error.as_string(),
+            exec_ctx
+          ))
+
+    # MyOPL has no syntax to reach a name inside a module, so its names are
+    # defined where IMPORT was called
+    for name, value in module.symbols.items():
+      exec_ctx.parent.symbol_table.set(name, value)
+    return Number.null
+  execute_import.arg_names = ["fn"]
+
 BuiltInFunction.print       = BuiltInFunction("print")
 BuiltInFunction.print_ret   = BuiltInFunction("print_ret")
 BuiltInFunction.input       = BuiltInFunction("input")
@@ -1868,6 +2566,16 @@ BuiltInFunction.pop         = BuiltInFunction("pop")
 BuiltInFunction.extend      = BuiltInFunction("extend")
 BuiltInFunction.len					= BuiltInFunction("len")
 BuiltInFunction.run					= BuiltInFunction("run")
+BuiltInFunction.import_     = BuiltInFunction("import")
+BuiltInFunction.join        = BuiltInFunction("join")
+BuiltInFunction.split       = BuiltInFunction("split")
+BuiltInFunction.substr      = BuiltInFunction("substr")
+BuiltInFunction.find        = BuiltInFunction("find")
+BuiltInFunction.replace     = BuiltInFunction("replace")
+
+# Symbol tables of imported modules by path, with a hash of the text they
+# were run from
+module_cache = {}
 
 #######################################
 # CONTEXT
@@ -1888,6 +2596,7 @@ class SymbolTable:
   def __init__(self, parent=None):
     self.symbols = {}
     self.parent = parent
+    self.scope = None
 
   def get(self, name):
     value = self.symbols.get(name, None)
@@ -1901,158 +2610,172 @@ class SymbolTable:
   def remove(self, name):
     del self.symbols[name]
 
+class Frame(SymbolTable):
+  def __init__(self, scope, parent=None):
+    super().__init__(parent)
+    self.scope = scope
+    self.slots = [None] * len(scope.slot_names)
+
+    # Caller frames can only hold the names their scopes declare. Lookups of
+    # any other name skip straight to `outer`, past every such frame, which
+    # keeps deep and tail recursion from walking one frame per call
+    # (names of this frame's own scope always take the slot path first)
+    if type(parent) is Frame and not parent.symbols:
+      self.outer = parent.outer
+      self.hidden = parent.hidden
+      if parent.scope is not scope and not parent.scope.slots.keys() <= self.hidden:
+        self.hidden = self.hidden | parent.scope.slots.keys()
+    else:
+      self.outer = parent
+      self.hidden = frozenset()
+
+  def get(self, name):
+    table = self
+    while type(table) is Frame:
+      slot = table.scope.slots.get(name)
+      if slot != None:
+        value = table.slots[slot]
+        if value != None: return value
+        table = table.parent
+        continue
+
+      if table.symbols:
+        value = table.symbols.get(name, None)
+        if value != None: return value
+      table = table.parent if name in table.hidden else table.outer
+
+    return table.get(name) if table else None
+
+  def set(self, name, value):
+    slot = self.scope.slots.get(name)
+    if slot != None:
+      self.slots[slot] = value
+    else:
+      self.symbols[name] = value
+
+  def remove(self, name):
+    slot = self.scope.slots.get(name)
+    if slot != None:
+      self.slots[slot] = None
+    else:
+      del self.symbols[name]
+
 #######################################
 # INTERPRETER
 #######################################
 
 class Interpreter:
   def visit(self, node, context):
-    method_name = f'visit_{type(node).__name__}'
-    method = getattr(self, method_name, self.no_visit_method)
-    return method(node, context)
-
-  def no_visit_method(self, node, context):
-    raise Exception(f'No visit_{type(node).__name__} method defined')
+    return node.evaluator(self, node, context)
 
   ###################################
 
   def visit_NumberNode(self, node, context):
-    return RTResult().success(
-      Number(node.tok.value).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return node.constant
 
   def visit_StringNode(self, node, context):
-    return RTResult().success(
-      String(node.tok.value).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return node.constant
 
   def visit_ListNode(self, node, context):
-    res = RTResult()
-    elements = []
-
-    for element_node in node.element_nodes:
-      elements.append(res.register(self.visit(element_node, context)))
-      if res.should_return(): return res
+    if not node.result_used:
+      for element_node in node.element_nodes:
+        self.visit(element_node, context)
+      return Number.null
 
-    return res.success(
-      List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    return List([self.visit(element_node, context) for element_node in node.element_nodes])
 
   def visit_VarAccessNode(self, node, context):
-    res = RTResult()
     var_name = node.var_name_tok.value
-    value = context.symbol_table.get(var_name)
+    symbol_table = context.symbol_table
+    if node.depth == 0 and node.slot != None and symbol_table.scope is node.scopes[0]:
+      value = symbol_table.slots[node.slot] or self.lookup(node, symbol_table)
+    else:
+      value = self.lookup(node, symbol_table)
 
     if not value:
-      return res.failure(RTError(
+      raise RTException(RTError(
         node.pos_start, node.pos_end,
         f"'{var_name}' is not defined",
         context
       ))
 
-    value = value.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
-    return res.success(value)
+    return value
+
+  def lookup(self, node, symbol_table):
+    # Follow the resolved (depth, slot) while the frames match the lexical
+    # scopes, otherwise fall back to the dynamic lookup by name
+    table = symbol_table
+    last = node.depth
+
+    for depth, scope in enumerate(node.scopes):
+      if table == None or table.scope is not scope: break
+      if depth == last:
+        value = table.symbols.get(node.var_name_tok.value) if node.slot == None else table.slots[node.slot]
+        if value != None: return value
+        break
+      table = table.parent
+
+    return symbol_table.get(node.var_name_tok.value)
 
   def visit_VarAssignNode(self, node, context):
-    res = RTResult()
     var_name = node.var_name_tok.value
-    value = res.register(self.visit(node.value_node, context))
-    if res.should_return(): return res
+    value = self.visit(node.value_node, context)
 
-    context.symbol_table.set(var_name, value)
-    return res.success(value)
+    symbol_table = context.symbol_table
+    if node.slot != None and symbol_table.scope is node.scope:
+      symbol_table.slots[node.slot] = value
+    else:
+      symbol_table.set(var_name, value)
+    return value
 
   def visit_BinOpNode(self, node, context):
-    res = RTResult()
-    left = res.register(self.visit(node.left_node, context))
-    if res.should_return(): return res
-    right = res.register(self.visit(node.right_node, context))
-    if res.should_return(): return res
-
-    if node.op_tok.type == TT_PLUS:
-      result, error = left.added_to(right)
-    elif node.op_tok.type == TT_MINUS:
-      result, error = left.subbed_by(right)
-    elif node.op_tok.type == TT_MUL:
-      result, error = left.multed_by(right)
-    elif node.op_tok.type == TT_DIV:
-      result, error = left.dived_by(right)
-    elif node.op_tok.type == TT_POW:
-      result, error = left.powed_by(right)
-    elif node.op_tok.type == TT_EE:
-      result, error = left.get_comparison_eq(right)
-    elif node.op_tok.type == TT_NE:
-      result, error = left.get_comparison_ne(right)
-    elif node.op_tok.type == TT_LT:
-      result, error = left.get_comparison_lt(right)
-    elif node.op_tok.type == TT_GT:
-      result, error = left.get_comparison_gt(right)
-    elif node.op_tok.type == TT_LTE:
-      result, error = left.get_comparison_lte(right)
-    elif node.op_tok.type == TT_GTE:
-      result, error = left.get_comparison_gte(right)
-    elif node.op_tok.matches(TT_KEYWORD, 'AND'):
-      result, error = left.anded_by(right)
-    elif node.op_tok.matches(TT_KEYWORD, 'OR'):
-      result, error = left.ored_by(right)
+    left = self.visit(node.left_node, context)
 
-    if error:
-      return res.failure(error)
-    else:
-      return res.success(result.set_pos(node.pos_start, node.pos_end))
+    if node.short_circuits:
+      result = left.short_circuit(node.op_tok.value)
+      if result: return result
 
-  def visit_UnaryOpNode(self, node, context):
-    res = RTResult()
-    number = res.register(self.visit(node.node, context))
-    if res.should_return(): return res
+    right = self.visit(node.right_node, context)
+    try:
+      return node.operator(left, right)
+    except RTException:
+      raise RTException(operation_error(node, context, binary_op_method(node.op_tok), left, right))
 
-    error = None
+  def visit_UnaryOpNode(self, node, context):
+    number = self.visit(node.node, context)
 
     if node.op_tok.type == TT_MINUS:
-      number, error = number.multed_by(Number(-1))
+      number = number.multed_by(Number.minus_one)
     elif node.op_tok.matches(TT_KEYWORD, 'NOT'):
-      number, error = number.notted()
+      number = number.notted()
 
-    if error:
-      return res.failure(error)
-    else:
-      return res.success(number.set_pos(node.pos_start, node.pos_end))
+    return number
 
   def visit_IfNode(self, node, context):
-    res = RTResult()
-
     for condition, expr, should_return_null in node.cases:
-      condition_value = res.register(self.visit(condition, context))
-      if res.should_return(): return res
+      condition_value = self.visit(condition, context)
 
       if condition_value.is_true():
-        expr_value = res.register(self.visit(expr, context))
-        if res.should_return(): return res
-        return res.success(Number.null if should_return_null else expr_value)
+        expr_value = self.visit(expr, context)
+        return Number.null if should_return_null else expr_value
 
     if node.else_case:
       expr, should_return_null = node.else_case
-      expr_value = res.register(self.visit(expr, context))
-      if res.should_return(): return res
-      return res.success(Number.null if should_return_null else expr_value)
+      expr_value = self.visit(expr, context)
+      return Number.null if should_return_null else expr_value
 
-    return res.success(Number.null)
+    return Number.null
 
   def visit_ForNode(self, node, context):
-    res = RTResult()
     elements = []
 
-    start_value = res.register(self.visit(node.start_value_node, context))
-    if res.should_return(): return res
-
-    end_value = res.register(self.visit(node.end_value_node, context))
-    if res.should_return(): return res
+    start_value = self.visit(node.start_value_node, context)
+    end_value = self.visit(node.end_value_node, context)
 
     if node.step_value_node:
-      step_value = res.register(self.visit(node.step_value_node, context))
-      if res.should_return(): return res
+      step_value = self.visit(node.step_value_node, context)
     else:
-      step_value = Number(1)
+      step_value = Number.true
 
     i = start_value.value
 
@@ -2060,141 +2783,1914 @@ class Interpreter:
       condition = lambda: i < end_value.value
     else:
       condition = lambda: i > end_value.value
-    
+
+    # The counter goes straight to its slot when the frame is of the scope
+    # the loop was resolved in, and through the symbol table otherwise
+    symbol_table = context.symbol_table
+    if node.slot != None and symbol_table.scope is node.scope:
+      assign, slot = symbol_table.slots.__setitem__, node.slot
+    else:
+      assign, slot = symbol_table.set, node.var_name_tok.value
+    collect = collects_results(node)
+
     while condition():
-      context.symbol_table.set(node.var_name_tok.value, Number(i))
+      assign(slot, make_number(i))
       i += step_value.value
 
-      value = res.register(self.visit(node.body_node, context))
-      if res.should_return() and res.loop_should_continue == False and res.loop_should_break == False: return res
-      
-      if res.loop_should_continue:
+      try:
+        value = self.visit(node.body_node, context)
+      except ContinueException:
         continue
-      
-      if res.loop_should_break:
+      except BreakException:
         break
 
-      elements.append(value)
+      if collect: elements.append(value)
 
-    return res.success(
-      Number.null if node.should_return_null else
-      List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    if not collect: return Number.null
+    return List(elements)
 
   def visit_WhileNode(self, node, context):
-    res = RTResult()
     elements = []
+    collect = collects_results(node)
 
     while True:
-      condition = res.register(self.visit(node.condition_node, context))
-      if res.should_return(): return res
+      condition = self.visit(node.condition_node, context)
 
       if not condition.is_true():
         break
 
-      value = res.register(self.visit(node.body_node, context))
-      if res.should_return() and res.loop_should_continue == False and res.loop_should_break == False: return res
-
-      if res.loop_should_continue:
+      try:
+        value = self.visit(node.body_node, context)
+      except ContinueException:
         continue
-      
-      if res.loop_should_break:
+      except BreakException:
         break
 
-      elements.append(value)
+      if collect: elements.append(value)
 
-    return res.success(
-      Number.null if node.should_return_null else
-      List(elements).set_context(context).set_pos(node.pos_start, node.pos_end)
-    )
+    if not collect: return Number.null
+    return List(elements)
 
   def visit_FuncDefNode(self, node, context):
-    res = RTResult()
-
     func_name = node.var_name_tok.value if node.var_name_tok else None
     body_node = node.body_node
     arg_names = [arg_name.value for arg_name in node.arg_name_toks]
-    func_value = Function(func_name, body_node, arg_names, node.should_auto_return).set_context(context).set_pos(node.pos_start, node.pos_end)
+    func_value = Function(func_name, body_node, arg_names, node.should_auto_return, node.body_scope).set_context(context).set_pos(node.pos_start, node.pos_end)
     
     if node.var_name_tok:
       context.symbol_table.set(func_name, func_value)
 
-    return res.success(func_value)
+    return func_value
 
   def visit_CallNode(self, node, context):
-    res = RTResult()
-    args = []
+    # The callee is copied to carry the call's position and context, which
+    # its frame links back to
+    value_to_call = self.visit(node.node_to_call, context)
+    value_to_call = value_to_call.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
 
-    value_to_call = res.register(self.visit(node.node_to_call, context))
-    if res.should_return(): return res
-    value_to_call = value_to_call.copy().set_pos(node.pos_start, node.pos_end)
-
-    for arg_node in node.arg_nodes:
-      args.append(res.register(self.visit(arg_node, context)))
-      if res.should_return(): return res
+    args = [self.visit(arg_node, context) for arg_node in node.arg_nodes]
+    if node.is_tail_call and type(value_to_call) is Function:
+      return TailCall(value_to_call, args)
 
-    return_value = res.register(value_to_call.execute(args))
-    if res.should_return(): return res
-    return_value = return_value.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
-    return res.success(return_value)
+    return value_to_call.execute(args)
 
   def visit_ReturnNode(self, node, context):
-    res = RTResult()
-
     if node.node_to_return:
-      value = res.register(self.visit(node.node_to_return, context))
-      if res.should_return(): return res
+      value = self.visit(node.node_to_return, context)
     else:
       value = Number.null
     
-    return res.success_return(value)
+    raise ReturnException(value)
 
   def visit_ContinueNode(self, node, context):
-    return RTResult().success_continue()
+    raise ContinueException.instance
 
   def visit_BreakNode(self, node, context):
-    return RTResult().success_break()
+    raise BreakException.instance
+
+# Each node class carries the Interpreter method that evaluates it
+for node_class in (
+  NumberNode, StringNode, ListNode, VarAccessNode, VarAssignNode, BinOpNode, UnaryOpNode,
+  IfNode, ForNode, WhileNode, FuncDefNode, CallNode, ReturnNode, ContinueNode, BreakNode
+):
+  node_class.evaluator = staticmethod(getattr(Interpreter, f'visit_{node_class.__name__}'))
 
 #######################################
-# RUN
+# STACK INTERPRETER
 #######################################
 
-global_symbol_table = SymbolTable()
-global_symbol_table.set("NULL", Number.null)
-global_symbol_table.set("FALSE", Number.false)
-global_symbol_table.set("TRUE", Number.true)
-global_symbol_table.set("MATH_PI", Number.math_PI)
-global_symbol_table.set("PRINT", BuiltInFunction.print)
-global_symbol_table.set("PRINT_RET", BuiltInFunction.print_ret)
-global_symbol_table.set("INPUT", BuiltInFunction.input)
-global_symbol_table.set("INPUT_INT", BuiltInFunction.input_int)
-global_symbol_table.set("CLEAR", BuiltInFunction.clear)
-global_symbol_table.set("CLS", BuiltInFunction.clear)
-global_symbol_table.set("IS_NUM", BuiltInFunction.is_number)
-global_symbol_table.set("IS_STR", BuiltInFunction.is_string)
-global_symbol_table.set("IS_LIST", BuiltInFunction.is_list)
-global_symbol_table.set("IS_FUN", BuiltInFunction.is_function)
-global_symbol_table.set("APPEND", BuiltInFunction.append)
-global_symbol_table.set("POP", BuiltInFunction.pop)
+# Nested calls allowed before the stack interpreter reports an error
+STACK_FRAME_BUDGET = 100000
+
+STACK_SIGNALS = (RTException, ReturnException, BreakException, ContinueException)
+
+class StackInterpreter(Interpreter):
+  # Walks the tree like Interpreter, but a node with children is evaluated by
+  # a generator that yields (node, context) for each child it needs and is
+  # sent back the value. visit keeps the generators on a list, so the Python
+  # stack stays flat however deep the program recurses. Signals raised by a
+  # child are thrown into its parent's generator.
+  def __init__(self, frame_budget=None):
+    self.frame_budget = STACK_FRAME_BUDGET if frame_budget == None else frame_budget
+    self.frames = 0
+
+  def visit(self, node, context):
+    stack = []
+    value = signal = None
+    request = (node, context)
+
+    while True:
+      if request:
+        node, context = request
+        if node.stepper:
+          stack.append(node.stepper(self, node, context))
+          value = None
+        else:
+          try:
+            value = node.evaluator(self, node, context)
+          except STACK_SIGNALS as e:
+            signal = e
+
+      if not stack:
+        if signal: raise signal
+        return value
+
+      generator = stack[-1]
+      try:
+        if signal:
+          signal, thrown = None, signal
+          request = generator.throw(thrown)
+        else:
+          request = generator.send(value)
+      except StopIteration as e:
+        stack.pop()
+        request = None
+        value = e.value
+      except STACK_SIGNALS as e:
+        stack.pop()
+        request = None
+        signal = e
+
+  def call(self, function, args, node, context):
+    if self.frames >= self.frame_budget:
+      raise RTException(RTError(
+        node.pos_start, node.pos_end,
+        f"Maximum recursion depth of {self.frame_budget} calls exceeded",
+        context
+      ))
+
+    self.frames += 1
+    try:
+      function.load_body()
+      exec_ctx = function.generate_new_context()
+      function.check_and_populate_args(function.arg_names, args, exec_ctx)
+
+      while True:
+        try:
+          value = yield (function.body_node, exec_ctx)
+          if not function.should_auto_return: value = Number.null
+        except ReturnException as e:
+          value = e.value
+
+        if type(value) is not TailCall: return value
+        function, exec_ctx = function.tail_call(value, exec_ctx)
+    finally:
+      self.frames -= 1
+
+  ###################################
+
+  def step_ListNode(self, node, context):
+    if not node.result_used:
+      for element_node in node.element_nodes:
+        yield (element_node, context)
+      return Number.null
+
+    elements = []
+    for element_node in node.element_nodes:
+      elements.append((yield (element_node, context)))
+    return List(elements)
+
+  def step_VarAssignNode(self, node, context):
+    var_name = node.var_name_tok.value
+    value = yield (node.value_node, context)
+
+    symbol_table = context.symbol_table
+    if node.slot != None and symbol_table.scope is node.scope:
+      symbol_table.slots[node.slot] = value
+    else:
+      symbol_table.set(var_name, value)
+    return value
+
+  def step_BinOpNode(self, node, context):
+    left = yield (node.left_node, context)
+
+    if node.short_circuits:
+      result = left.short_circuit(node.op_tok.value)
+      if result: return result
+
+    right = yield (node.right_node, context)
+    try:
+      return node.operator(left, right)
+    except RTException:
+      raise RTException(operation_error(node, context, binary_op_method(node.op_tok), left, right))
+
+  def step_UnaryOpNode(self, node, context):
+    number = yield (node.node, context)
+
+    if node.op_tok.type == TT_MINUS:
+      number = number.multed_by(Number.minus_one)
+    elif node.op_tok.matches(TT_KEYWORD, 'NOT'):
+      number = number.notted()
+
+    return number
+
+  def step_IfNode(self, node, context):
+    for condition, expr, should_return_null in node.cases:
+      condition_value = yield (condition, context)
+
+      if condition_value.is_true():
+        expr_value = yield (expr, context)
+        return Number.null if should_return_null else expr_value
+
+    if node.else_case:
+      expr, should_return_null = node.else_case
+      expr_value = yield (expr, context)
+      return Number.null if should_return_null else expr_value
+
+    return Number.null
+
+  def step_ForNode(self, node, context):
+    elements = []
+
+    start_value = yield (node.start_value_node, context)
+    end_value = yield (node.end_value_node, context)
+
+    if node.step_value_node:
+      step_value = yield (node.step_value_node, context)
+    else:
+      step_value = Number.true
+
+    i = start_value.value
+
+    if step_value.value >= 0:
+      condition = lambda: i < end_value.value
+    else:
+      condition = lambda: i > end_value.value
+
+    # The counter goes straight to its slot when the frame is of the scope
+    # the loop was resolved in, and through the symbol table otherwise
+    symbol_table = context.symbol_table
+    if node.slot != None and symbol_table.scope is node.scope:
+      assign, slot = symbol_table.slots.__setitem__, node.slot
+    else:
+      assign, slot = symbol_table.set, node.var_name_tok.value
+    collect = collects_results(node)
+
+    while condition():
+      assign(slot, make_number(i))
+      i += step_value.value
+
+      try:
+        value = yield (node.body_node, context)
+      except ContinueException:
+        continue
+      except BreakException:
+        break
+
+      if collect: elements.append(value)
+
+    if not collect: return Number.null
+    return List(elements)
+
+  def step_WhileNode(self, node, context):
+    elements = []
+    collect = collects_results(node)
+
+    while True:
+      condition = yield (node.condition_node, context)
+
+      if not condition.is_true():
+        break
+
+      try:
+        value = yield (node.body_node, context)
+      except ContinueException:
+        continue
+      except BreakException:
+        break
+
+      if collect: elements.append(value)
+
+    if not collect: return Number.null
+    return List(elements)
+
+  def step_CallNode(self, node, context):
+    value_to_call = yield (node.node_to_call, context)
+    value_to_call = value_to_call.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
+
+    args = []
+    for arg_node in node.arg_nodes:
+      args.append((yield (arg_node, context)))
+
+    if type(value_to_call) is not Function:
+      return_value = value_to_call.execute(args)
+    elif node.is_tail_call:
+      return TailCall(value_to_call, args)
+    else:
+      return_value = yield from self.call(value_to_call, args, node, context)
+
+    return return_value
+
+  def step_ReturnNode(self, node, context):
+    if node.node_to_return:
+      value = yield (node.node_to_return, context)
+    else:
+      value = Number.null
+
+    raise ReturnException(value)
+
+# Nodes without children are evaluated directly by their evaluator
+for node_class in (NumberNode, StringNode, VarAccessNode, FuncDefNode, ContinueNode, BreakNode):
+  node_class.stepper = None
+for node_class in (
+  ListNode, VarAssignNode, BinOpNode, UnaryOpNode, IfNode, ForNode, WhileNode, CallNode, ReturnNode
+):
+  node_class.stepper = staticmethod(getattr(StackInterpreter, f'step_{node_class.__name__}'))
+
+#######################################
+# BYTECODE
+#######################################
+
+OP_LOAD_CONST         = 0
+OP_LOAD_NAME          = 1
+OP_STORE_NAME         = 2
+OP_POP_TOP            = 3
+OP_POP_N              = 4
+OP_BINARY_OP          = 5
+OP_UNARY_MINUS        = 6
+OP_UNARY_NOT          = 7
+OP_BUILD_LIST         = 8
+OP_LIST_APPEND        = 9
+OP_JUMP               = 10
+OP_POP_JUMP_IF_FALSE  = 11
+OP_FOR_PREP           = 12
+OP_FOR_ITER           = 13
+OP_MAKE_FUNCTION      = 14
+OP_CALL               = 15
+OP_RETURN_VALUE       = 16
+OP_JUMP_IF_AND_DONE   = 17
+OP_JUMP_IF_OR_DONE    = 18
+OP_RAISE_SIGNAL       = 19
+
+SHORT_CIRCUIT_OPS = {'AND': OP_JUMP_IF_AND_DONE, 'OR': OP_JUMP_IF_OR_DONE}
+
+BINARY_OP_METHODS = {
+  TT_PLUS: 'added_to',
+  TT_MINUS: 'subbed_by',
+  TT_MUL: 'multed_by',
+  TT_DIV: 'dived_by',
+  TT_POW: 'powed_by',
+  TT_EE: 'get_comparison_eq',
+  TT_NE: 'get_comparison_ne',
+  TT_LT: 'get_comparison_lt',
+  TT_GT: 'get_comparison_gt',
+  TT_LTE: 'get_comparison_lte',
+  TT_GTE: 'get_comparison_gte',
+  (TT_KEYWORD, 'AND'): 'anded_by',
+  (TT_KEYWORD, 'OR'): 'ored_by',
+}
+
+# Number (op) Number shortcuts, equivalent to the matching Number methods
+NUMBER_FAST_OPS = {
+  'added_to': lambda a, b: a + b,
+  'subbed_by': lambda a, b: a - b,
+  'multed_by': lambda a, b: a * b,
+  'get_comparison_eq': lambda a, b: int(a == b),
+  'get_comparison_ne': lambda a, b: int(a != b),
+  'get_comparison_lt': lambda a, b: int(a < b),
+  'get_comparison_gt': lambda a, b: int(a > b),
+  'get_comparison_lte': lambda a, b: int(a <= b),
+  'get_comparison_gte': lambda a, b: int(a >= b),
+}
+
+# Operator functions that BinOpNodes are bound to, one per Value method
+BINARY_OPERATORS = {
+  'added_to': lambda left, right: left.added_to(right),
+  'subbed_by': lambda left, right: left.subbed_by(right),
+  'multed_by': lambda left, right: left.multed_by(right),
+  'dived_by': lambda left, right: left.dived_by(right),
+  'powed_by': lambda left, right: left.powed_by(right),
+  'get_comparison_eq': lambda left, right: left.get_comparison_eq(right),
+  'get_comparison_ne': lambda left, right: left.get_comparison_ne(right),
+  'get_comparison_lt': lambda left, right: left.get_comparison_lt(right),
+  'get_comparison_gt': lambda left, right: left.get_comparison_gt(right),
+  'get_comparison_lte': lambda left, right: left.get_comparison_lte(right),
+  'get_comparison_gte': lambda left, right: left.get_comparison_gte(right),
+  'anded_by': lambda left, right: left.anded_by(right),
+  'ored_by': lambda left, right: left.ored_by(right),
+}
+
+def binary_op_method(op_tok):
+  if op_tok.type == TT_KEYWORD:
+    return BINARY_OP_METHODS[(op_tok.type, op_tok.value)]
+  return BINARY_OP_METHODS[op_tok.type]
+
+def operation_error(node, context, method_name, left, right):
+  # Compiled code keeps no positions on its values; give the operands the
+  # positions of their nodes and redo the operation to get the same error
+  # the tree walker would report
+  left = left.copy().set_pos(node.left_node.pos_start, node.left_node.pos_end).set_context(context)
+  right = right.copy().set_pos(node.right_node.pos_start, node.right_node.pos_end).set_context(context)
+  try:
+    getattr(left, method_name)(right)
+  except RTException as e:
+    return e.error
+
+class CodeObject:
+  def __init__(self, name):
+    self.name = name
+    self.instructions = []
+    # Node that emitted each instruction, used to rebuild error positions
+    self.line_table = []
+
+  def __repr__(self):
+    return f'<code {self.name}, {len(self.instructions)} instructions>'
+
+#######################################
+# COMPILER
+#######################################
+
+class Compiler:
+  def __init__(self, name='<program>', in_function=False):
+    self.code = CodeObject(name)
+    self.in_function = in_function
+    self.stack_depth = 0
+    self.loops = []
+
+  def compile_program(self, node):
+    self.compile(node)
+    self.emit(OP_RETURN_VALUE, None, node)
+    return self.code
+
+  def compile_function(self, node):
+    self.compile(node.body_node)
+    if not node.should_auto_return:
+      self.emit(OP_POP_TOP, None, node)
+      self.emit(OP_LOAD_CONST, Number.null, node)
+    self.emit(OP_RETURN_VALUE, None, node)
+    return self.code
+
+  def compile(self, node):
+    method_name = f'compile_{type(node).__name__}'
+    method = getattr(self, method_name, self.no_compile_method)
+    method(node)
+
+  def no_compile_method(self, node):
+    raise Exception(f'No compile_{type(node).__name__} method defined')
+
+  ###################################
+
+  def emit(self, op, arg, node):
+    self.code.instructions.append((op, arg))
+    self.code.line_table.append(node)
+
+    if op in (OP_LOAD_CONST, OP_LOAD_NAME, OP_MAKE_FUNCTION):
+      self.stack_depth += 1
+    elif op in (OP_POP_TOP, OP_BINARY_OP, OP_POP_JUMP_IF_FALSE, OP_LIST_APPEND, OP_RETURN_VALUE):
+      self.stack_depth -= 1
+    elif op == OP_POP_N:
+      self.stack_depth -= arg
+    elif op == OP_BUILD_LIST:
+      self.stack_depth += 1 - arg
+    elif op == OP_CALL:
+      self.stack_depth -= arg[0]
+    elif op == OP_FOR_PREP:
+      self.stack_depth -= 2
+
+    return len(self.code.instructions) - 1
+
+  def patch(self, index, target=None):
+    op, _ = self.code.instructions[index]
+    if target == None: target = len(self.code.instructions)
+    self.code.instructions[index] = (op, target)
+
+  def emit_unwind(self, loop, node):
+    extra = self.stack_depth - loop['stack_depth']
+    if extra > 0:
+      self.emit(OP_POP_N, extra, node)
+
+  ###################################
+
+  def compile_NumberNode(self, node):
+    self.emit(OP_LOAD_CONST, node.constant, node)
+
+  def compile_StringNode(self, node):
+    self.emit(OP_LOAD_CONST, node.constant, node)
+
+  def compile_ListNode(self, node):
+    if not node.result_used:
+      for element_node in node.element_nodes:
+        self.compile(element_node)
+        self.emit(OP_POP_TOP, None, element_node)
+      self.emit(OP_LOAD_CONST, Number.null, node)
+      return
+
+    for element_node in node.element_nodes:
+      self.compile(element_node)
+    self.emit(OP_BUILD_LIST, len(node.element_nodes), node)
+
+  def compile_VarAccessNode(self, node):
+    self.emit(OP_LOAD_NAME, node.var_name_tok.value, node)
+
+  def compile_VarAssignNode(self, node):
+    self.compile(node.value_node)
+    self.emit(OP_STORE_NAME, node.var_name_tok.value, node)
+
+  def compile_BinOpNode(self, node):
+    self.compile(node.left_node)
+    short_circuit_jump = None
+    if node.op_tok.type == TT_KEYWORD:
+      short_circuit_jump = self.emit(SHORT_CIRCUIT_OPS[node.op_tok.value], None, node)
+
+    self.compile(node.right_node)
+    method_name = binary_op_method(node.op_tok)
+    self.emit(OP_BINARY_OP, (method_name, NUMBER_FAST_OPS.get(method_name)), node)
+
+    if short_circuit_jump != None:
+      self.patch(short_circuit_jump)
+
+  def compile_UnaryOpNode(self, node):
+    self.compile(node.node)
+    if node.op_tok.type == TT_MINUS:
+      self.emit(OP_UNARY_MINUS, None, node)
+    elif node.op_tok.matches(TT_KEYWORD, 'NOT'):
+      self.emit(OP_UNARY_NOT, None, node)
+
+  def compile_IfNode(self, node):
+    end_jumps = []
+    base_depth = self.stack_depth
+
+    for condition, expr, should_return_null in node.cases:
+      self.compile(condition)
+      next_case_jump = self.emit(OP_POP_JUMP_IF_FALSE, None, condition)
+      self.compile_branch(expr, should_return_null)
+      end_jumps.append(self.emit(OP_JUMP, None, node))
+      self.patch(next_case_jump)
+      self.stack_depth = base_depth
+
+    if node.else_case:
+      expr, should_return_null = node.else_case
+      self.compile_branch(expr, should_return_null)
+    else:
+      self.emit(OP_LOAD_CONST, Number.null, node)
+
+    for jump in end_jumps:
+      self.patch(jump)
+
+  def compile_branch(self, node, should_return_null):
+    self.compile(node)
+    if should_return_null:
+      self.emit(OP_POP_TOP, None, node)
+      self.emit(OP_LOAD_CONST, Number.null, node)
+
+  def compile_ForNode(self, node):
+    if collects_results(node):
+      self.emit(OP_BUILD_LIST, 0, node)
+
+    self.compile(node.start_value_node)
+    self.compile(node.end_value_node)
+    if node.step_value_node:
+      self.compile(node.step_value_node)
+    else:
+      self.emit(OP_LOAD_CONST, Number.true, node)
+    self.emit(OP_FOR_PREP, None, node)
+
+    loop_start = len(self.code.instructions)
+    exit_jump = self.emit(OP_FOR_ITER, None, node)
+    self.compile_loop_body(node, loop_start, 2)
+    self.patch(exit_jump, (node.var_name_tok.value, len(self.code.instructions)))
+
+    self.emit(OP_POP_TOP, None, node)
+    if not collects_results(node):
+      self.emit(OP_LOAD_CONST, Number.null, node)
+
+  def compile_WhileNode(self, node):
+    if collects_results(node):
+      self.emit(OP_BUILD_LIST, 0, node)
+
+    loop_start = len(self.code.instructions)
+    self.compile(node.condition_node)
+    exit_jump = self.emit(OP_POP_JUMP_IF_FALSE, None, node.condition_node)
+    self.compile_loop_body(node, loop_start, 1)
+    self.patch(exit_jump)
+
+    if not collects_results(node):
+      self.emit(OP_LOAD_CONST, Number.null, node)
+
+  def compile_loop_body(self, node, loop_start, acc_offset):
+    loop = {'start': loop_start, 'stack_depth': self.stack_depth, 'break_jumps': []}
+    self.loops.append(loop)
+
+    self.compile(node.body_node)
+    if collects_results(node):
+      self.emit(OP_LIST_APPEND, acc_offset, node)
+    else:
+      self.emit(OP_POP_TOP, None, node)
+    self.emit(OP_JUMP, loop_start, node)
+
+    self.loops.pop()
+    for jump in loop['break_jumps']:
+      self.patch(jump)
+    loop['end'] = len(self.code.instructions)
+
+  def compile_FuncDefNode(self, node):
+    func_name = node.var_name_tok.value if node.var_name_tok else None
+    arg_names = [arg_name.value for arg_name in node.arg_name_toks]
+    code = Compiler(func_name or '<anonymous>', True).compile_function(node)
+    self.emit(OP_MAKE_FUNCTION, (func_name, arg_names, code, node.body_node, node.should_auto_return), node)
+
+  def compile_CallNode(self, node):
+    self.compile(node.node_to_call)
+    for arg_node in node.arg_nodes:
+      self.compile(arg_node)
+    # A BREAK or CONTINUE raised by the callee applies to the enclosing loop
+    self.emit(OP_CALL, (len(node.arg_nodes), self.loops[-1] if self.loops else None), node)
+
+  def compile_ReturnNode(self, node):
+    if node.node_to_return:
+      self.compile(node.node_to_return)
+    else:
+      self.emit(OP_LOAD_CONST, Number.null, node)
+    self.emit_exit(node)
+
+  def compile_ContinueNode(self, node):
+    if not self.loops: return self.emit_raise(node, ContinueException.instance)
+    loop = self.loops[-1]
+    self.emit_unwind(loop, node)
+    self.emit(OP_JUMP, loop['start'], node)
+    self.stack_depth = loop['stack_depth'] + 1
+
+  def compile_BreakNode(self, node):
+    if not self.loops: return self.emit_raise(node, BreakException.instance)
+    loop = self.loops[-1]
+    self.emit_unwind(loop, node)
+    loop['break_jumps'].append(self.emit(OP_JUMP, None, node))
+    self.stack_depth = loop['stack_depth'] + 1
+
+  def emit_exit(self, node):
+    # RETURN leaves the code object; at the top level this stops the
+    # program without a result, like the tree walker
+    if not self.in_function:
+      self.emit(OP_POP_TOP, None, node)
+      self.emit(OP_LOAD_CONST, None, node)
+    self.emit(OP_RETURN_VALUE, None, node)
+    # Keep the depth of the unreachable code after the exit consistent
+    self.stack_depth += 1
+
+  def emit_raise(self, node, signal):
+    # A BREAK or CONTINUE outside any loop of this code object ends the call
+    # and is handled by the loop around the caller, like the tree walker
+    self.emit(OP_RAISE_SIGNAL, signal, node)
+    self.stack_depth += 1
+
+#######################################
+# VIRTUAL MACHINE
+#######################################
+
+class CompiledFunction(Function):
+  __slots__ = ('code',)
+
+  def __init__(self, name, body_node, arg_names, should_auto_return, code):
+    super().__init__(name, body_node, arg_names, should_auto_return)
+    self.code = code
+
+  def execute(self, args):
+    exec_ctx = self.generate_new_context()
+    self.check_and_populate_args(self.arg_names, args, exec_ctx)
+    try:
+      return VM().run(self.code, exec_ctx)
+    except RecursionError:
+      raise self.recursion_error()
+
+  def copy(self):
+    copy = CompiledFunction(self.name, self.body_node, self.arg_names, self.should_auto_return, self.code)
+    copy.set_context(self.context)
+    copy.set_pos(self.pos_start, self.pos_end)
+    return copy
+
+class VM:
+  def run(self, code, context):
+    instructions = code.instructions
+    symbol_table = context.symbol_table
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    ip = 0
+
+    while True:
+      op, arg = instructions[ip]
+      ip += 1
+
+      if op == OP_LOAD_NAME:
+        value = symbol_table.get(arg)
+        if value == None:
+          node = code.line_table[ip - 1]
+          raise RTException(RTError(
+            node.pos_start, node.pos_end,
+            f"'{arg}' is not defined",
+            context
+          ))
+        push(value)
+
+      elif op == OP_LOAD_CONST:
+        push(arg)
+
+      elif op == OP_BINARY_OP:
+        right = pop()
+        left = stack[-1]
+        method_name, fast_op = arg
+        if fast_op and type(left) is Number and type(right) is Number:
+          stack[-1] = make_number(fast_op(left.value, right.value))
+          continue
+
+        try:
+          stack[-1] = getattr(left, method_name)(right)
+        except RTException:
+          raise RTException(operation_error(code.line_table[ip - 1], context, method_name, left, right))
+
+      elif op == OP_STORE_NAME:
+        symbol_table.set(arg, stack[-1])
+
+      elif op == OP_POP_TOP:
+        pop()
+
+      elif op == OP_POP_JUMP_IF_FALSE:
+        if not pop().is_true():
+          ip = arg
+
+      elif op == OP_JUMP:
+        ip = arg
+
+      elif op == OP_JUMP_IF_AND_DONE or op == OP_JUMP_IF_OR_DONE:
+        result = stack[-1].short_circuit('AND' if op == OP_JUMP_IF_AND_DONE else 'OR')
+        if result:
+          stack[-1] = result
+          ip = arg
+
+      elif op == OP_FOR_ITER:
+        state = stack[-1]
+        i, end, step = state
+        if (i < end) if step >= 0 else (i > end):
+          symbol_table.set(arg[0], make_number(i))
+          state[0] = i + step
+        else:
+          ip = arg[1]
+
+      elif op == OP_CALL:
+        arg_count, loop = arg
+        if arg_count:
+          args = stack[-arg_count:]
+          del stack[-arg_count:]
+        else:
+          args = []
+        node = code.line_table[ip - 1]
+        value_to_call = pop().copy().set_pos(node.pos_start, node.pos_end).set_context(context)
+
+        try:
+          push(value_to_call.execute(args))
+        except (BreakException, ContinueException) as signal:
+          if not loop: raise
+          del stack[loop['stack_depth']:]
+          ip = loop['end'] if isinstance(signal, BreakException) else loop['start']
+
+      elif op == OP_LIST_APPEND:
+        value = pop()
+        stack[-arg].append(value)
+
+      elif op == OP_BUILD_LIST:
+        if arg:
+          elements = stack[-arg:]
+          del stack[-arg:]
+        else:
+          elements = []
+        push(List(elements))
+
+      elif op == OP_POP_N:
+        del stack[-arg:]
+
+      elif op == OP_UNARY_MINUS:
+        stack[-1] = stack[-1].multed_by(Number.minus_one)
+
+      elif op == OP_UNARY_NOT:
+        stack[-1] = stack[-1].notted()
+
+      elif op == OP_MAKE_FUNCTION:
+        func_name, arg_names, func_code, body_node, should_auto_return = arg
+        node = code.line_table[ip - 1]
+        func_value = CompiledFunction(func_name, body_node, arg_names, should_auto_return, func_code).set_context(context).set_pos(node.pos_start, node.pos_end)
+        if func_name:
+          symbol_table.set(func_name, func_value)
+        push(func_value)
+
+      elif op == OP_FOR_PREP:
+        step_value = pop()
+        end_value = pop()
+        stack[-1] = [stack[-1].value, end_value.value, step_value.value]
+
+      elif op == OP_RETURN_VALUE:
+        return pop()
+
+      elif op == OP_RAISE_SIGNAL:
+        raise arg
+
+#######################################
+# CLOSURE COMPILER
+#######################################
+
+class ClosureFunction(Function):
+  __slots__ = ('body',)
+
+  def __init__(self, name, body_node, arg_names, should_auto_return, body):
+    super().__init__(name, body_node, arg_names, should_auto_return)
+    self.body = body
+
+  def execute(self, args):
+    exec_ctx = self.generate_new_context()
+
+    if len(args) != len(self.arg_names):
+      self.check_args(self.arg_names, args)
+    symbols = exec_ctx.symbol_table.symbols
+    for arg_name, arg_value in zip(self.arg_names, args):
+      symbols[arg_name] = arg_value
+
+    try:
+      return self.body(exec_ctx)
+    except ReturnException as e:
+      return e.value
+    except RecursionError:
+      raise self.recursion_error()
+
+  def copy(self):
+    copy = ClosureFunction(self.name, self.body_node, self.arg_names, self.should_auto_return, self.body)
+    copy.set_context(self.context)
+    copy.set_pos(self.pos_start, self.pos_end)
+    return copy
+
+class ClosureCompiler:
+  def compile(self, node):
+    method_name = f'compile_{type(node).__name__}'
+    method = getattr(self, method_name, self.no_compile_method)
+    return method(node)
+
+  def no_compile_method(self, node):
+    raise Exception(f'No compile_{type(node).__name__} method defined')
+
+  ###################################
+
+  def compile_NumberNode(self, node):
+    value = node.constant
+    return lambda context: value
+
+  def compile_StringNode(self, node):
+    value = node.constant
+    return lambda context: value
+
+  def compile_ListNode(self, node):
+    element_funcs = [self.compile(element_node) for element_node in node.element_nodes]
+
+    if not node.result_used:
+      def statements_expr(context):
+        for func in element_funcs:
+          func(context)
+        return Number.null
+      return statements_expr
+
+    def list_expr(context):
+      return List([func(context) for func in element_funcs])
+    return list_expr
+
+  def compile_VarAccessNode(self, node):
+    var_name = node.var_name_tok.value
+
+    def var_access(context):
+      value = context.symbol_table.get(var_name)
+      if value == None:
+        raise RTException(RTError(
+          node.pos_start, node.pos_end,
+          f"'{var_name}' is not defined",
+          context
+        ))
+      return value
+    return var_access
+
+  def compile_VarAssignNode(self, node):
+    var_name = node.var_name_tok.value
+    value_func = self.compile(node.value_node)
+
+    def var_assign(context):
+      value = value_func(context)
+      context.symbol_table.set(var_name, value)
+      return value
+    return var_assign
+
+  def compile_BinOpNode(self, node):
+    left_func = self.compile(node.left_node)
+    method_name = binary_op_method(node.op_tok)
+    fast_op = NUMBER_FAST_OPS.get(method_name)
+
+    def slow_path(context, left, right):
+      try:
+        return getattr(left, method_name)(right)
+      except RTException:
+        raise RTException(operation_error(node, context, method_name, left, right))
+
+    if node.op_tok.type == TT_KEYWORD:
+      keyword = node.op_tok.value
+      right_func = self.compile(node.right_node)
+
+      def short_circuit_op(context):
+        left = left_func(context)
+        result = left.short_circuit(keyword)
+        if result: return result
+        return slow_path(context, left, right_func(context))
+      return short_circuit_op
+
+    if fast_op and isinstance(node.right_node, NumberNode):
+      right = node.right_node.constant
+      right_value = right.value
+
+      def bin_op_const(context):
+        left = left_func(context)
+        if type(left) is Number:
+          return make_number(fast_op(left.value, right_value))
+        return slow_path(context, left, right)
+      return bin_op_const
+
+    right_func = self.compile(node.right_node)
+
+    if fast_op:
+      def bin_op_fast(context):
+        left = left_func(context)
+        right = right_func(context)
+        if type(left) is Number and type(right) is Number:
+          return make_number(fast_op(left.value, right.value))
+        return slow_path(context, left, right)
+      return bin_op_fast
+
+    def bin_op(context):
+      return slow_path(context, left_func(context), right_func(context))
+    return bin_op
+
+  def compile_UnaryOpNode(self, node):
+    operand_func = self.compile(node.node)
+
+    if node.op_tok.type == TT_MINUS:
+      def unary_op(context):
+        return operand_func(context).multed_by(Number.minus_one)
+    elif node.op_tok.matches(TT_KEYWORD, 'NOT'):
+      def unary_op(context):
+        return operand_func(context).notted()
+    else:
+      return operand_func
+    return unary_op
+
+  def compile_IfNode(self, node):
+    cases = [
+      (self.compile(condition), self.compile(expr), should_return_null)
+      for condition, expr, should_return_null in node.cases
+    ]
+    if node.else_case:
+      else_func = self.compile(node.else_case[0])
+      else_returns_null = node.else_case[1]
+    else:
+      else_func = None
+
+    def if_expr(context):
+      for condition_func, expr_func, should_return_null in cases:
+        if condition_func(context).is_true():
+          value = expr_func(context)
+          return Number.null if should_return_null else value
+
+      if else_func:
+        value = else_func(context)
+        return Number.null if else_returns_null else value
+
+      return Number.null
+    return if_expr
+
+  def compile_ForNode(self, node):
+    var_name = node.var_name_tok.value
+    start_func = self.compile(node.start_value_node)
+    end_func = self.compile(node.end_value_node)
+    step_func = self.compile(node.step_value_node) if node.step_value_node else None
+    body_func = self.compile_loop_body(node)
+    collect = collects_results(node)
+
+    def for_expr(context):
+      i = start_func(context).value
+      end = end_func(context).value
+      step = step_func(context).value if step_func else 1
+      symbols = context.symbol_table
+      elements = []
+
+      while (i < end) if step >= 0 else (i > end):
+        symbols.set(var_name, make_number(i))
+        i += step
+
+        try:
+          value = body_func(context)
+        except ContinueException:
+          continue
+        except BreakException:
+          break
+
+        if collect:
+          elements.append(value)
+        elif value is BreakException.instance:
+          break
+
+      return List(elements) if collect else Number.null
+    return for_expr
+
+  def compile_WhileNode(self, node):
+    condition_func = self.compile(node.condition_node)
+    body_func = self.compile_loop_body(node)
+    collect = collects_results(node)
+
+    def while_expr(context):
+      elements = []
+
+      while condition_func(context).is_true():
+        try:
+          value = body_func(context)
+        except ContinueException:
+          continue
+        except BreakException:
+          break
+
+        if collect:
+          elements.append(value)
+        elif value is BreakException.instance:
+          break
+
+      return List(elements) if collect else Number.null
+    return while_expr
+
+  def compile_loop_body(self, node):
+    # In a multi-line body, top-level `IF ... THEN CONTINUE` and
+    # `IF ... THEN BREAK` guards are checked in place: the body returns the
+    # signal instance to its loop instead of raising it
+    body_node = node.body_node
+    if collects_results(node) or not isinstance(body_node, ListNode):
+      return self.compile(body_node)
+
+    steps = []
+    for statement in body_node.element_nodes:
+      signal = self.loop_guard_signal(statement)
+      if signal:
+        steps.append((self.compile(statement.cases[0][0]), signal))
+      else:
+        steps.append((self.compile(statement), None))
+
+    def loop_body(context):
+      for func, signal in steps:
+        if signal:
+          if func(context).is_true(): return signal
+        else:
+          func(context)
+      return Number.null
+    return loop_body
+
+  def loop_guard_signal(self, node):
+    if not isinstance(node, IfNode) or len(node.cases) != 1 or node.else_case:
+      return None
+
+    expr = node.cases[0][1]
+    if isinstance(expr, ListNode) and len(expr.element_nodes) == 1:
+      expr = expr.element_nodes[0]
+
+    if isinstance(expr, ContinueNode): return ContinueException.instance
+    if isinstance(expr, BreakNode): return BreakException.instance
+    return None
+
+  def compile_FuncDefNode(self, node):
+    func_name = node.var_name_tok.value if node.var_name_tok else None
+    arg_names = [arg_name.value for arg_name in node.arg_name_toks]
+    body = self.compile_function_body(node)
+    should_auto_return = node.should_auto_return
+
+    def func_def(context):
+      func_value = ClosureFunction(func_name, node.body_node, arg_names, should_auto_return, body).set_context(context).set_pos(node.pos_start, node.pos_end)
+      if func_name:
+        context.symbol_table.set(func_name, func_value)
+      return func_value
+    return func_def
+
+  def compile_function_body(self, node):
+    # The returned closure yields the function's result directly. A RETURN
+    # among the top-level statements of the body ends it, so that value is
+    # handed back without raising ReturnException
+    body_node = node.body_node
+
+    if node.should_auto_return:
+      return self.compile(body_node)
+
+    statement_nodes = body_node.element_nodes if isinstance(body_node, ListNode) else [body_node]
+    return_func = None
+
+    for index, statement in enumerate(statement_nodes):
+      if isinstance(statement, ReturnNode):
+        if statement.node_to_return:
+          return_func = self.compile(statement.node_to_return)
+        statement_nodes = statement_nodes[:index]
+        break
+
+    statement_funcs = [self.compile(statement) for statement in statement_nodes]
+
+    def function_body(context):
+      for func in statement_funcs:
+        func(context)
+      return return_func(context) if return_func else Number.null
+    return function_body
+
+  def compile_CallNode(self, node):
+    callee_func = self.compile(node.node_to_call)
+    arg_funcs = [self.compile(arg_node) for arg_node in node.arg_nodes]
+
+    def call(context):
+      value_to_call = callee_func(context).copy().set_pos(node.pos_start, node.pos_end).set_context(context)
+      args = [func(context) for func in arg_funcs]
+      return value_to_call.execute(args)
+    return call
+
+  def compile_ReturnNode(self, node):
+    value_func = self.compile(node.node_to_return) if node.node_to_return else None
+
+    def return_statement(context):
+      raise ReturnException(value_func(context) if value_func else Number.null)
+    return return_statement
+
+  def compile_ContinueNode(self, node):
+    def continue_statement(context):
+      raise ContinueException.instance
+    return continue_statement
+
+  def compile_BreakNode(self, node):
+    def break_statement(context):
+      raise BreakException.instance
+    return break_statement
+
+#######################################
+# PYTHON TRANSPILER
+#######################################
+
+def transpiled_load(symbol_table, var_name, node, context):
+  value = symbol_table.get(var_name)
+  if value == None:
+    raise RTException(RTError(
+      node.pos_start, node.pos_end,
+      f"'{var_name}' is not defined",
+      context
+    ))
+  return value
+
+def transpiled_bin_op(left, right, method_name, node, context):
+  try:
+    return getattr(left, method_name)(right)
+  except RTException:
+    raise RTException(operation_error(node, context, method_name, left, right))
+
+def transpiled_unary_op(operand, method_name, node, context):
+  if method_name == 'multed_by':
+    return operand.multed_by(Number.minus_one)
+  return operand.notted()
+
+def transpiled_for_range(start, end, step):
+  if type(start) is int and type(end) is int and type(step) is int and step != 0:
+    return range(start, end, step)
+  return transpiled_float_range(start, end, step)
+
+def transpiled_float_range(i, end, step):
+  while (i < end) if step >= 0 else (i > end):
+    yield i
+    i += step
+
+def transpiled_function(func_name, body, arg_names, should_auto_return, node, context):
+  func_value = ClosureFunction(func_name, node.body_node, arg_names, should_auto_return, body).set_context(context).set_pos(node.pos_start, node.pos_end)
+  if func_name:
+    context.symbol_table.set(func_name, func_value)
+  return func_value
+
+def transpiled_call(value_to_call, args, node, context):
+  value_to_call = value_to_call.copy().set_pos(node.pos_start, node.pos_end).set_context(context)
+  return value_to_call.execute(args)
+
+TRANSPILED_RUNTIME = {
+  '_Number': Number,
+  '_number': make_number,
+  '_List': List,
+  '_null': Number.null,
+  '_load': transpiled_load,
+  '_bin_op': transpiled_bin_op,
+  '_unary_op': transpiled_unary_op,
+  '_for_range': transpiled_for_range,
+  '_function': transpiled_function,
+  '_call': transpiled_call,
+  '_break': BreakException.instance,
+  '_continue': ContinueException.instance,
+  '_Break': BreakException,
+  '_Continue': ContinueException,
+}
+
+# Python operators for Number (op) Number, equivalent to the Number methods
+PYTHON_NUMBER_OPS = {
+  'added_to': '{} + {}',
+  'subbed_by': '{} - {}',
+  'multed_by': '{} * {}',
+  'get_comparison_eq': 'int({} == {})',
+  'get_comparison_ne': 'int({} != {})',
+  'get_comparison_lt': 'int({} < {})',
+  'get_comparison_gt': 'int({} > {})',
+  'get_comparison_lte': 'int({} <= {})',
+  'get_comparison_gte': 'int({} >= {})',
+}
+
+def contains_call(node):
+  # Whether running the node can call a function, outside of the bodies of
+  # the functions it defines
+  if isinstance(node, CallNode): return True
+  if isinstance(node, FuncDefNode): return False
+  return any(contains_call(child) for child in child_nodes(node))
+
+class PythonFunctionSource:
+  def __init__(self, name, in_function):
+    self.name = name
+    self.in_function = in_function
+    self.lines = [f'def {name}(context):', '  st = context.symbol_table', '  symbols = st.symbols']
+    self.indent = 1
+    self.temp_count = 0
+    self.loop_depth = 0
+
+class PythonTranspiler:
+  def __init__(self):
+    # Literal values and nodes are passed in through the globals, so programs
+    # of the same shape produce the same source and share one code object
+    self.constants = []
+    self.nodes = []
+    self.functions = []
+    self.number_constants = set()
+    self.function_count = 0
+    self.current = None
+
+  def transpile(self, node):
+    self.begin_function('_program', False)
+    value = self.expr(node)
+    self.line(f'return {value}')
+    self.end_function()
+    return '\n\n'.join(self.functions) + '\n'
+
+  def namespace(self):
+    namespace = dict(TRANSPILED_RUNTIME)
+    for i, value in enumerate(self.constants):
+      namespace[f'_c{i}'] = value
+    for i, node in enumerate(self.nodes):
+      namespace[f'_n{i}'] = node
+    return namespace
+
+  def load(self, node):
+    source = self.transpile(node)
+    key = hashlib.sha1(source.encode('utf-8')).hexdigest()
+    code = python_code_cache.get(key)
+    if code == None:
+      code = compile(source, '<myopl transpiled>', 'exec')
+      python_code_cache.put(key, code)
+
+    namespace = self.namespace()
+    exec(code, namespace)
+    return namespace['_program']
+
+  ###################################
+
+  def begin_function(self, name, in_function):
+    previous = self.current
+    self.current = PythonFunctionSource(name, in_function)
+    return previous
+
+  def end_function(self, previous=None):
+    self.functions.append('\n'.join(self.current.lines))
+    self.current = previous
+
+  def line(self, text):
+    self.current.lines.append('  ' * self.current.indent + text)
+
+  def temp(self):
+    self.current.temp_count += 1
+    return f'_t{self.current.temp_count}'
+
+  def const(self, value):
+    self.constants.append(value)
+    return f'_c{len(self.constants) - 1}'
+
+  def node_ref(self, node):
+    self.nodes.append(node)
+    return f'_n{len(self.nodes) - 1}'
+
+  def truth(self, value):
+    return f'(({value}.value != 0) if type({value}) is _Number else {value}.is_true())'
+
+  def expr(self, node):
+    method_name = f'expr_{type(node).__name__}'
+    method = getattr(self, method_name, self.no_expr_method)
+    return method(node)
+
+  def no_expr_method(self, node):
+    raise Exception(f'No expr_{type(node).__name__} method defined')
+
+  ###################################
+
+  def expr_NumberNode(self, node):
+    name = self.const(node.constant)
+    self.number_constants.add(name)
+    return name
+
+  def expr_StringNode(self, node):
+    return self.const(node.constant)
+
+  def expr_ListNode(self, node):
+    elements = [self.expr(element_node) for element_node in node.element_nodes]
+    if not node.result_used: return '_null'
+    result = self.temp()
+    self.line(f'{result} = _List([{", ".join(elements)}])')
+    return result
+
+  def expr_VarAccessNode(self, node):
+    var_name = repr(node.var_name_tok.value)
+    result = self.temp()
+    self.line(f'{result} = symbols.get({var_name})')
+    self.line(f'if {result} is None: {result} = _load(st, {var_name}, {self.node_ref(node)}, context)')
+    return result
+
+  def expr_VarAssignNode(self, node):
+    value = self.expr(node.value_node)
+    self.line(f'symbols[{node.var_name_tok.value!r}] = {value}')
+    return value
+
+  def expr_BinOpNode(self, node):
+    left = self.expr(node.left_node)
+    method_name = binary_op_method(node.op_tok)
+
+    if node.op_tok.type == TT_KEYWORD:
+      result = self.temp()
+      self.line(f'{result} = {left}.short_circuit({node.op_tok.value!r})')
+      self.line(f'if {result} is None:')
+      self.current.indent += 1
+      right = self.expr(node.right_node)
+      self.line(f'{result} = _bin_op({left}, {right}, {method_name!r}, {self.node_ref(node)}, context)')
+      self.current.indent -= 1
+      return result
+
+    right = self.expr(node.right_node)
+    slow_path = f'_bin_op({left}, {right}, {method_name!r}, {self.node_ref(node)}, context)'
+    result = self.temp()
+
+    fast_op = PYTHON_NUMBER_OPS.get(method_name)
+    if fast_op:
+      fast_path = '_number(' + fast_op.format(f'{left}.value', f'{right}.value') + ')'
+      checks = [f'type({value}) is _Number' for value in (left, right) if value not in self.number_constants]
+      self.line(f'{result} = {fast_path} if {" and ".join(checks) or "True"} else {slow_path}')
+    else:
+      self.line(f'{result} = {slow_path}')
+    return result
+
+  def expr_UnaryOpNode(self, node):
+    operand = self.expr(node.node)
+    if node.op_tok.type == TT_MINUS:
+      result = self.temp()
+      slow_path = f"_unary_op({operand}, 'multed_by', {self.node_ref(node)}, context)"
+      self.line(f'{result} = _number(-{operand}.value) if type({operand}) is _Number else {slow_path}')
+      return result
+    if node.op_tok.matches(TT_KEYWORD, 'NOT'):
+      result = self.temp()
+      self.line(f"{result} = _unary_op({operand}, 'notted', {self.node_ref(node)}, context)")
+      return result
+    return operand
+
+  def expr_IfNode(self, node):
+    result = self.temp()
+    base_indent = self.current.indent
+
+    for condition, expr, should_return_null in node.cases:
+      condition_value = self.expr(condition)
+      self.line(f'if {self.truth(condition_value)}:')
+      self.current.indent += 1
+      self.branch(result, expr, should_return_null)
+      self.current.indent -= 1
+      self.line('else:')
+      self.current.indent += 1
+
+    if node.else_case:
+      expr, should_return_null = node.else_case
+      self.branch(result, expr, should_return_null)
+    else:
+      self.line(f'{result} = _null')
+
+    self.current.indent = base_indent
+    return result
+
+  def branch(self, result, node, should_return_null):
+    value = self.expr(node)
+    self.line(f'{result} = _null' if should_return_null else f'{result} = {value}')
+
+  def expr_ForNode(self, node):
+    start = self.expr(node.start_value_node)
+    end = self.expr(node.end_value_node)
+    step = f'{self.expr(node.step_value_node)}.value' if node.step_value_node else '1'
+    elements = self.temp()
+    i = self.temp()
+    collect = collects_results(node)
+
+    if collect: self.line(f'{elements} = []')
+    self.line(f'for {i} in _for_range({start}.value, {end}.value, {step}):')
+    self.current.indent += 1
+    self.line(f'symbols[{node.var_name_tok.value!r}] = _number({i})')
+    self.loop_body(node, elements, collect)
+    self.current.indent -= 1
+
+    return self.loop_result(elements, collect)
+
+  def expr_WhileNode(self, node):
+    elements = self.temp()
+    collect = collects_results(node)
+
+    if collect: self.line(f'{elements} = []')
+    self.line('while True:')
+    self.current.indent += 1
+    condition = self.expr(node.condition_node)
+    self.line(f'if not {self.truth(condition)}: break')
+    self.loop_body(node, elements, collect)
+    self.current.indent -= 1
+
+    return self.loop_result(elements, collect)
+
+  def loop_body(self, node, elements, collect):
+    # BREAK and CONTINUE in a called function are raised, and act on the
+    # loop the call was made from
+    catches_signals = contains_call(node.body_node)
+    if catches_signals:
+      self.line('try:')
+      self.current.indent += 1
+
+    self.current.loop_depth += 1
+    value = self.expr(node.body_node)
+    self.current.loop_depth -= 1
+
+    if catches_signals:
+      self.current.indent -= 1
+      self.line('except _Continue: continue')
+      self.line('except _Break: break')
+    self.line(f'{elements}.append({value})' if collect else 'pass')
+
+  def loop_result(self, elements, collect):
+    if not collect: return '_null'
+    result = self.temp()
+    self.line(f'{result} = _List({elements})')
+    return result
+
+  def expr_FuncDefNode(self, node):
+    func_name = node.var_name_tok.value if node.var_name_tok else None
+    arg_names = [arg_name.value for arg_name in node.arg_name_toks]
+    self.function_count += 1
+    python_name = f'_f{self.function_count}'
+
+    previous = self.begin_function(python_name, True)
+    value = self.expr(node.body_node)
+    self.line(f'return {value}' if node.should_auto_return else 'return _null')
+    self.end_function(previous)
+
+    result = self.temp()
+    self.line(f'{result} = _function({func_name!r}, {python_name}, {arg_names!r}, {node.should_auto_return}, {self.node_ref(node)}, context)')
+    return result
+
+  def expr_CallNode(self, node):
+    value_to_call = self.expr(node.node_to_call)
+    args = [self.expr(arg_node) for arg_node in node.arg_nodes]
+    result = self.temp()
+    self.line(f'{result} = _call({value_to_call}, [{", ".join(args)}], {self.node_ref(node)}, context)')
+    return result
+
+  def expr_ReturnNode(self, node):
+    value = self.expr(node.node_to_return) if node.node_to_return else '_null'
+    # RETURN at the top level stops the program without a result
+    self.line(f'return {value}' if self.current.in_function else 'return None')
+    return '_null'
+
+  def expr_ContinueNode(self, node):
+    self.line('continue' if self.current.loop_depth else 'raise _continue')
+    return '_null'
+
+  def expr_BreakNode(self, node):
+    self.line('break' if self.current.loop_depth else 'raise _break')
+    return '_null'
+
+#######################################
+# AST CACHE
+#######################################
+
+# Parsed files are cached like Python's __pycache__, next to the script. A
+# cache file starts with a fixed-size header of magic, the script's mtime,
+# a hash of its text and the lengths of the two int arrays after it: the
+# AST as codes in postfix order, then four ints per token. The token values
+# come last, marshalled. Set the directory to None to neither read nor
+# write the cache
+AST_CACHE_DIR = '__myoplcache__'
+AST_CACHE_MAGIC = b'MYOPL\x00\x00\x02'
+AST_CACHE_HEADER = struct.Struct('<8sq20sqq')
+
+# A code is a tag in its low bits with a payload above them. AST_TOKENS is
+# the run of tokens a LazyBodyNode skipped, from the token its payload
+# indexes, and the code after it is the run's length
+AST_CONSTANT, AST_NODE, AST_TOKEN, AST_POSITION, AST_LIST, AST_TUPLE, AST_TOKENS = range(7)
+AST_TAG_BITS = 3
+AST_TAG_MASK = (1 << AST_TAG_BITS) - 1
+AST_CONSTANTS = (None, False, True)
+
+# The constructor arguments of each node, which it keeps as attributes
+AST_NODE_FIELDS = {
+  NumberNode: ('tok',),
+  StringNode: ('tok',),
+  ListNode: ('element_nodes', 'pos_start', 'pos_end'),
+  VarAccessNode: ('var_name_tok',),
+  VarAssignNode: ('var_name_tok', 'value_node'),
+  BinOpNode: ('left_node', 'op_tok', 'right_node'),
+  UnaryOpNode: ('op_tok', 'node'),
+  IfNode: ('cases', 'else_case'),
+  ForNode: ('var_name_tok', 'start_value_node', 'end_value_node', 'step_value_node', 'body_node', 'should_return_null'),
+  WhileNode: ('condition_node', 'body_node', 'should_return_null'),
+  FuncDefNode: ('var_name_tok', 'arg_name_toks', 'body_node', 'should_auto_return'),
+  LazyBodyNode: ('tokens',),
+  CallNode: ('node_to_call', 'arg_nodes'),
+  ReturnNode: ('node_to_return', 'pos_start', 'pos_end'),
+  ContinueNode: ('pos_start', 'pos_end'),
+  BreakNode: ('pos_start', 'pos_end'),
+}
+AST_NODE_TYPES = list(AST_NODE_FIELDS)
+
+class AstWriter:
+  def __init__(self):
+    self.codes = array.array('i')
+    self.token_table = array.array('i')
+    self.token_indexes = {}
+    self.values = []
+    self.value_indexes = {}
+
+  def write(self, value):
+    value_type = type(value)
+
+    if value_type in AST_NODE_FIELDS:
+      if value_type is LazyBodyNode:
+        self.write_token_run(value.tokens)
+      else:
+        for field in AST_NODE_FIELDS[value_type]:
+          self.write(getattr(value, field))
+      self.codes.append(AST_NODE_TYPES.index(value_type) << AST_TAG_BITS | AST_NODE)
+    elif value_type is Token:
+      self.codes.append(self.token_index(value) << AST_TAG_BITS | AST_TOKEN)
+    elif value_type is Position:
+      self.codes.append((value.idx << 1 | value.is_end) << AST_TAG_BITS | AST_POSITION)
+    elif value_type in (list, tuple):
+      for item in value:
+        self.write(item)
+      tag = AST_LIST if value_type is list else AST_TUPLE
+      self.codes.append(len(value) << AST_TAG_BITS | tag)
+    else:
+      self.codes.append(AST_CONSTANTS.index(value) << AST_TAG_BITS | AST_CONSTANT)
+
+  def write_token_run(self, tokens):
+    start = len(self.token_indexes)
+    for offset, tok in enumerate(tokens):
+      if self.token_index(tok) != start + offset:
+        raise ValueError("Skipped tokens are not a run")
+    self.codes.extend((start << AST_TAG_BITS | AST_TOKENS, len(tokens)))
+
+  def token_index(self, tok):
+    index = self.token_indexes.get(id(tok))
+    if index == None:
+      index = self.token_indexes[id(tok)] = len(self.token_indexes)
+      self.token_table.extend((tok.type, tok.start, tok.end, self.value_index(tok.value)))
+    return index
+
+  def value_index(self, value):
+    key = (type(value), value)
+    index = self.value_indexes.get(key)
+    if index == None:
+      index = self.value_indexes[key] = len(self.values)
+      self.values.append(value)
+    return index
+
+class AstReader:
+  def __init__(self, codes, token_table, values, source):
+    self.codes = codes
+    self.tokens = list(map(
+      Token,
+      token_table[0::4],
+      map(values.__getitem__, token_table[3::4]),
+      token_table[1::4],
+      token_table[2::4],
+      [source] * (len(token_table) // 4)
+    ))
+    self.source = source
+
+  def read(self):
+    # Each code pushes a value, taking the ones it is built from off the
+    # top of the stack
+    stack = []
+    push = stack.append
+    tokens = self.tokens
+    codes = iter(self.codes)
+    field_counts = [len(AST_NODE_FIELDS[node_type]) for node_type in AST_NODE_TYPES]
+
+    for code in codes:
+      tag, payload = code & AST_TAG_MASK, code >> AST_TAG_BITS
+
+      if tag == AST_NODE:
+        count = field_counts[payload]
+        args = stack[-count:]
+        del stack[-count:]
+        push(AST_NODE_TYPES[payload](*args))
+      elif tag == AST_TOKEN:
+        push(tokens[payload])
+      elif tag == AST_POSITION:
+        push(Position(payload >> 1, self.source, bool(payload & 1)))
+      elif tag == AST_LIST or tag == AST_TUPLE:
+        items = stack[-payload:] if payload else []
+        if payload: del stack[-payload:]
+        push(items if tag == AST_LIST else tuple(items))
+      elif tag == AST_TOKENS:
+        push(tokens[payload:payload + next(codes)])
+      else:
+        push(AST_CONSTANTS[payload])
+
+    node, = stack
+    return node
+
+def ast_cache_path(fn, lazy):
+  directory, name = os.path.split(os.path.abspath(fn))
+  kind = 'lazy' if lazy else 'full'
+  return os.path.join(directory, AST_CACHE_DIR, f'{name}.{kind}.ast')
+
+def file_mtime(fn):
+  try:
+    return os.stat(fn).st_mtime_ns
+  except (OSError, ValueError):
+    return None
+
+def file_digest(file):
+  # The file is read through once and rewound for the lexer
+  digest = hashlib.sha1()
+  for chunk in iter(lambda: file.read(LEXER_CHUNK_SIZE), ''):
+    digest.update(chunk.encode())
+  file.seek(0)
+  return digest.digest()
+
+def load_cached_ast(fn, path, key):
+  try:
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      if len(data) < AST_CACHE_HEADER.size: return None
+      magic, mtime, digest, code_count, token_count = AST_CACHE_HEADER.unpack_from(data)
+      if magic != AST_CACHE_MAGIC or (mtime, digest) != key: return None
+
+      codes = array.array('i')
+      token_table = array.array('i')
+      codes_start = AST_CACHE_HEADER.size
+      tokens_start = codes_start + code_count * codes.itemsize
+      values_start = tokens_start + token_count * token_table.itemsize
+      codes.frombytes(data[codes_start:tokens_start])
+      token_table.frombytes(data[tokens_start:values_start])
+      values = marshal.loads(data[values_start:])
+  except Exception:
+    # A cache file that cannot be read is parsed again and replaced
+    return None
+
+  # The AST is many small objects and no cycles, so the collector would only
+  # spend time walking it while it grows
+  gc_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    return AstReader(codes, token_table, values, Source(fn)).read()
+  except Exception:
+    return None
+  finally:
+    if gc_enabled: gc.enable()
+
+def store_cached_ast(path, key, node):
+  # Written to a temporary file first, so a reader never sees half of one
+  temp_path = f'{path}.{os.getpid()}.tmp'
+  try:
+    writer = AstWriter()
+    writer.write(node)
+    values = marshal.dumps(writer.values)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(temp_path, 'wb') as f:
+      f.write(AST_CACHE_HEADER.pack(AST_CACHE_MAGIC, *key, len(writer.codes), len(writer.token_table)))
+      f.write(writer.codes.tobytes())
+      f.write(writer.token_table.tobytes())
+      f.write(values)
+    os.replace(temp_path, path)
+  except (OSError, ValueError, OverflowError, RecursionError):
+    try:
+      os.remove(temp_path)
+    except OSError:
+      pass
+
+#######################################
+# PARSE CACHE
+#######################################
+
+PARSE_CACHE_SIZE = 256
+PYTHON_CODE_CACHE_SIZE = 256
+
+class ParseCache:
+  # Parsed programs by file name, a hash of their text and whether they
+  # were parsed lazily, keeping the most recently used. A cached tree is
+  # never annotated itself: each run resolves and marks the copy of it that
+  # the optimizer returns
+  def __init__(self, size):
+    self.size = size
+    self.entries = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    node = self.entries.get(key)
+    if node == None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    self.entries.move_to_end(key)
+    return node
+
+  def put(self, key, node):
+    self.entries[key] = node
+    self.entries.move_to_end(key)
+    while len(self.entries) > max(self.size, 0):
+      self.entries.popitem(last=False)
+
+  def clear(self):
+    self.entries.clear()
+    self.hits = self.misses = 0
+
+parse_cache = ParseCache(PARSE_CACHE_SIZE)
+
+# Code objects the python mode compiled, by a hash of their source
+python_code_cache = ParseCache(PYTHON_CODE_CACHE_SIZE)
+
+#######################################
+# RUN
+#######################################
+
+global_symbol_table = SymbolTable()
+global_symbol_table.set("NULL", Number.null)
+global_symbol_table.set("FALSE", Number.false)
+global_symbol_table.set("TRUE", Number.true)
+global_symbol_table.set("MATH_PI", Number.math_PI)
+global_symbol_table.set("PRINT", BuiltInFunction.print)
+global_symbol_table.set("PRINT_RET", BuiltInFunction.print_ret)
+global_symbol_table.set("INPUT", BuiltInFunction.input)
+global_symbol_table.set("INPUT_INT", BuiltInFunction.input_int)
+global_symbol_table.set("CLEAR", BuiltInFunction.clear)
+global_symbol_table.set("CLS", BuiltInFunction.clear)
+global_symbol_table.set("IS_NUM", BuiltInFunction.is_number)
+global_symbol_table.set("IS_STR", BuiltInFunction.is_string)
+global_symbol_table.set("IS_LIST", BuiltInFunction.is_list)
+global_symbol_table.set("IS_FUN", BuiltInFunction.is_function)
+global_symbol_table.set("APPEND", BuiltInFunction.append)
+global_symbol_table.set("POP", BuiltInFunction.pop)
 global_symbol_table.set("EXTEND", BuiltInFunction.extend)
 global_symbol_table.set("LEN", BuiltInFunction.len)
 global_symbol_table.set("RUN", BuiltInFunction.run)
-
-def run(fn, text):
-  # Generate tokens
-  lexer = Lexer(fn, text)
-  tokens, error = lexer.make_tokens()
-  if error: return None, error
-  
-  # Generate AST
-  parser = Parser(tokens)
-  ast = parser.parse()
+global_symbol_table.set("IMPORT", BuiltInFunction.import_)
+global_symbol_table.set("JOIN", BuiltInFunction.join)
+global_symbol_table.set("SPLIT", BuiltInFunction.split)
+global_symbol_table.set("SUBSTR", BuiltInFunction.substr)
+global_symbol_table.set("FIND", BuiltInFunction.find)
+global_symbol_table.set("REPLACE", BuiltInFunction.replace)
+
+STRICT_PARSING = False
+LAZY_MODES = ('tree', 'stack')
+
+# The mode of the program running now, which files it runs with RUN use too
+execution_mode = 'tree'
+
+def run(fn, text, mode='tree'):
+  key = (fn, hashlib.sha1(text.encode()).digest(), False)
+  node = parse_cache.get(key)
+
+  if not node:
+    # Generate tokens
+    lexer = Lexer(fn, text)
+    tokens, error = lexer.make_tokens()
+    if error: return None, error
+
+    # Generate AST
+    parser = Parser(tokens)
+    ast = parser.parse()
+    if ast.error: return None, ast.error
+    node = ast.node
+    parse_cache.put(key, node)
+
+  return run_program(node, mode)
+
+def run_file(fn, file, mode='tree', strict=None, symbol_table=None):
+  # Tokens are lexed from the file as the parser asks for them, so neither
+  # the text nor the token list is held in memory whole. Where functions
+  # run through Function.execute their bodies are only parsed once called,
+  # unless strict parsing asks for syntax errors anywhere in the file. A
+  # file that has not changed since it was last parsed skips both
+  if strict == None: strict = STRICT_PARSING
+  lazy = not strict and mode in LAZY_MODES
+  digest = file_digest(file)
+
+  key = (fn, digest, lazy)
+  node = parse_cache.get(key)
+  if not node:
+    node, error = parse_file(fn, file, lazy, digest)
+    if error: return None, error
+    parse_cache.put(key, node)
+
+  return run_program(node, mode, symbol_table)
+
+def parse_file(fn, file, lazy, digest):
+  cache_path = AST_CACHE_DIR and ast_cache_path(fn, lazy)
+  mtime = file_mtime(fn) if cache_path else None
+  if mtime != None:
+    node = load_cached_ast(fn, cache_path, (mtime, digest))
+    if node: return node, None
+
+  lexer = Lexer(fn, file=file)
+  tokens = lexer.generate_tokens()
+  ast = Parser(tokens, lazy).parse()
+
+  # An illegal character anywhere is reported before a syntax error
+  if ast.error and not lexer.error:
+    for _ in tokens: pass
+  if lexer.error: return None, lexer.error
   if ast.error: return None, ast.error
 
+  if mtime != None: store_cached_ast(cache_path, (mtime, digest), ast.node)
+  return ast.node, None
+
+def run_program(node, mode='tree', symbol_table=None):
+  # Programs run in the global symbol table, modules in their own
+  if symbol_table == None: symbol_table = global_symbol_table
+  node = Optimizer(symbol_table).optimize_program(node)
+  Resolver().resolve(node)
+  mark_result_usage(node)
+  mark_tail_calls(node)
+
   # Run program
-  interpreter = Interpreter()
   context = Context('<program>')
-  context.symbol_table = global_symbol_table
-  result = interpreter.visit(ast.node, context)
-
-  return result.value, result.error
+  context.symbol_table = symbol_table
+
+  if mode == 'tree':
+    program = lambda context: Interpreter().visit(node, context)
+  elif mode == 'stack':
+    program = lambda context: StackInterpreter().visit(node, context)
+  elif mode == 'vm':
+    code = Compiler().compile_program(node)
+    program = lambda context: VM().run(code, context)
+  elif mode == 'closure':
+    program = ClosureCompiler().compile(node)
+  elif mode == 'python':
+    # Python limits how deeply blocks nest, so a program past that limit
+    # runs as closures instead
+    try:
+      program = PythonTranspiler().load(node)
+    except SyntaxError:
+      program = ClosureCompiler().compile(node)
+  else:
+    raise Exception(f"Unknown execution mode '{mode}'")
+
+  global execution_mode
+  outer_mode, execution_mode = execution_mode, mode
+  try:
+    return program(context), None
+  except RTException as e:
+    return None, e.error
+  except (ReturnException, BreakException, ContinueException):
+    # RETURN, BREAK or CONTINUE at the top level stops the program
+    return None, None
+  except RecursionError:
+    # Deep recursion outside of any call, such as deeply nested expressions
+    return None, RTError(node.pos_start, node.pos_end, "Maximum recursion depth exceeded", context)
+  finally:
+    execution_mode = outer_mode
+
+def prepare_function_body(node, scope):
+  # The passes run_program makes, for a body parsed after the program began
+  node = Optimizer(global_symbol_table).optimize(node)
+  Resolver().resolve_body(node, scope)
+  mark_result_usage(node, False)
+  mark_tail_calls(node, True)
+  return node
@@ -0,0 +1,257 @@
+import gc
+import sys
+import time
+import tracemalloc
+import basic
+
+LOOP_SCRIPT = '''
+VAR total = 0
+FOR i = 0 TO 100000 THEN
+	VAR total = total + i * 2 - 1
+END
+total
+'''
+
+FIB_SCRIPT = '''
+FUN fib(n) -> IF n < 2 THEN n ELSE fib(n - 1) + fib(n - 2)
+fib(18)
+'''
+
+WHILE_SCRIPT = '''
+FUN count(limit)
+	VAR i = 0
+	VAR hits = 0
+	WHILE i < limit THEN
+		VAR i = i + 1
+		IF i < limit / 2 THEN CONTINUE
+		VAR hits = hits + 1
+	END
+	RETURN hits
+END
+count(100000)
+'''
+
+DEEP_SCRIPT = '''
+VAR g = 1
+FUN down(n) -> IF n == 0 THEN 0 ELSE g + g + g + down(n - 1)
+FUN repeat(times)
+	VAR total = 0
+	FOR i = 0 TO times THEN
+		VAR total = total + down(300)
+	END
+	RETURN total
+END
+repeat(100)
+'''
+
+FOLD_SCRIPT = '''
+FUN draw(rows)
+	VAR total = 0
+	FOR i = 0 TO rows THEN
+		VAR total = total + 2 ^ 10 * MATH_PI + IS_STR("-" * 40) * (IF 40 > 10 THEN 1 ELSE 2)
+	END
+	RETURN total
+END
+draw(50000)
+'''
+
+GUARD_SCRIPT = '''
+FUN check(x) -> x * x / 7 > 3
+FUN guards(n)
+	VAR hits = 0
+	FOR i = 0 TO n THEN
+		IF i < 0 AND check(i) THEN VAR hits = hits - 1
+		IF i >= 0 OR check(i) THEN VAR hits = hits + 1
+		IF i > n AND check(i) AND check(i + 1) THEN VAR hits = hits - 1
+	END
+	RETURN hits
+END
+guards(30000)
+'''
+
+DISCARD_SCRIPT = '''
+FUN fill(n)
+	VAR total = 0
+	FOR i = 0 TO n THEN VAR total = total + i
+	WHILE total > 0 THEN VAR total = total - n
+	RETURN total
+END
+fill(100000)
+'''
+
+TAIL_SCRIPT = '''
+FUN count(n, total) -> IF n == 0 THEN total ELSE count(n - 1, total + n)
+count(2000, 0)
+'''
+
+RECURSE_SCRIPT = '''
+FUN sum(n) -> IF n == 0 THEN 0 ELSE n + sum(n - 1)
+FUN repeat(times)
+	VAR total = 0
+	FOR i = 0 TO times THEN
+		VAR total = total + sum(800)
+	END
+	RETURN total
+END
+repeat(50)
+'''
+
+LIST_SCRIPT = '''
+FUN build(n)
+	VAR items = []
+	VAR copies = []
+	FOR i = 0 TO n THEN
+		APPEND(items, i)
+		VAR copies = copies + i
+	END
+	VAR total = 0
+	FOR i = 0 TO n THEN VAR total = total + items / i - copies / -(i + 1)
+	RETURN total
+END
+build(20000)
+'''
+
+# The join from example.myopl over 100k pieces. Repeating the result once
+# reads its value, so a deferred concatenation has to be flattened in time
+JOIN_SCRIPT = '''
+FUN join(elements, separator)
+	VAR result = ""
+	VAR len = LEN(elements)
+
+	FOR i = 0 TO len THEN
+		VAR result = result + elements/i
+		IF i != len - 1 THEN VAR result = result + separator
+	END
+
+	RETURN result
+END
+
+FUN build(n)
+	VAR pieces = []
+	FOR i = 0 TO n THEN APPEND(pieces, "piece")
+	RETURN join(pieces, ", ") * 1
+END
+IS_STR(build(100000))
+'''
+
+# The same pieces joined by the native JOIN
+NATIVE_SCRIPT = '''
+FUN build(n)
+	VAR pieces = []
+	FOR i = 0 TO n THEN APPEND(pieces, "piece")
+	RETURN JOIN(pieces, ", ") * 1
+END
+IS_STR(build(100000))
+'''
+
+BENCHMARKS = {
+	'loop': LOOP_SCRIPT,
+	'fib': FIB_SCRIPT,
+	'while': WHILE_SCRIPT,
+	'deep': DEEP_SCRIPT,
+	'fold': FOLD_SCRIPT,
+	'guard': GUARD_SCRIPT,
+	'discard': DISCARD_SCRIPT,
+	'tail': TAIL_SCRIPT,
+	'recurse': RECURSE_SCRIPT,
+	'list': LIST_SCRIPT,
+	'join': JOIN_SCRIPT,
+	'native': NATIVE_SCRIPT,
+}
+
+MODES = ['tree', 'stack', 'vm', 'closure', 'python']
+
+# Front-end benchmarks only lex and parse their script, lazily or not
+PARSE_SCRIPT = '''
+FUN shape(a, b, c)
+	VAR total = a * b + c ^ 2 ^ -1 - (a - b) / (c + 1)
+	IF total >= 10 AND NOT a == b OR c < -a THEN RETURN [total, a, b] ELSE RETURN total
+END
+VAR result = shape(1, 2, 3) + shape(-4, 5 * 6, 7 / 8) * 2 - -1
+''' * 2000
+
+PARSE_BENCHMARKS = {
+	'parse': (PARSE_SCRIPT, False),
+	'lazy': (PARSE_SCRIPT, True),
+}
+
+# Memory benchmarks report the bytes taken by each Number, and by each AST
+# node of a large program with the tokens, positions and lists it holds
+MEMORY_BENCHMARKS = {
+	'memory': (PARSE_SCRIPT, 100000),
+}
+
+def time_script(name, text, mode, repeat=3):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result, error = basic.run(f'<{name}>', text, mode)
+		elapsed = time.perf_counter() - start
+		if error:
+			raise Exception(error.as_string())
+		best = elapsed if best == None else min(best, elapsed)
+	return best, result
+
+def time_parser(name, text, lazy, repeat=3):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		tokens, error = basic.Lexer(f'<{name}>', text).make_tokens()
+		if error:
+			raise Exception(error.as_string())
+		ast = basic.Parser(tokens, lazy).parse()
+		elapsed = time.perf_counter() - start
+		if ast.error:
+			raise Exception(ast.error.as_string())
+		best = elapsed if best == None else min(best, elapsed)
+	return best, len(tokens)
+
+def traced_size(make):
+	gc.collect()
+	tracemalloc.start()
+	try:
+		result = make()
+		size = tracemalloc.get_traced_memory()[0]
+	finally:
+		tracemalloc.stop()
+	return size, result
+
+def count_nodes(node):
+	return 1 + sum(count_nodes(child) for child in basic.child_nodes(node))
+
+def measure_memory(name, text, number_count):
+	values = [i + 0.5 for i in range(number_count)]
+	size, numbers = traced_size(lambda: [basic.Number(value) for value in values])
+	number_bytes = (size - sys.getsizeof(numbers)) / number_count
+
+	tokens, error = basic.Lexer(f'<{name}>', text).make_tokens()
+	if error:
+		raise Exception(error.as_string())
+	size, ast = traced_size(lambda: basic.Parser(tokens).parse())
+	if ast.error:
+		raise Exception(ast.error.as_string())
+	return number_bytes, size / count_nodes(ast.node)
+
+def main(names):
+	for name in names:
+		if name in MEMORY_BENCHMARKS:
+			number_bytes, node_bytes = measure_memory(name, *MEMORY_BENCHMARKS[name])
+			print(f'{name:<8} {"number":<8} {number_bytes:9.1f} bytes')
+			print(f'{name:<8} {"node":<8} {node_bytes:9.1f} bytes')
+			continue
+
+		if name in PARSE_BENCHMARKS:
+			elapsed, token_count = time_parser(name, *PARSE_BENCHMARKS[name])
+			print(f'{name:<8} {"front":<8} {elapsed * 1000:9.1f} ms  {token_count / elapsed:9.0f} tokens/s')
+			continue
+
+		text = BENCHMARKS[name]
+		baseline = None
+		for mode in MODES:
+			elapsed, result = time_script(name, text, mode)
+			if baseline == None: baseline = elapsed
+			print(f'{name:<8} {mode:<8} {elapsed * 1000:9.1f} ms  x{baseline / elapsed:5.2f}  {result}')
+
+if __name__ == '__main__':
+	sys.setrecursionlimit(10000)
+	main(sys.argv[1:] or list(BENCHMARKS) + list(PARSE_BENCHMARKS) + list(MEMORY_BENCHMARKS))
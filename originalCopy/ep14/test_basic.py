@@ -0,0 +1,234 @@
+import os
+import tempfile
+import unittest
+
+import basic
+
+LAZY_MODES = ('tree', 'stack')
+COMPILING_MODES = ('vm', 'closure', 'python')
+
+PROGRAM = '''\
+# A bit of every kind of node
+VAR count = 0
+FUN add(a, b) -> a + b * 2.5 ^ -1
+FUN walk(items)
+  VAR result = []
+  FOR i = 0 TO LEN(items) STEP 1 THEN
+    IF i == 1 THEN CONTINUE ELIF i > 5 THEN BREAK ELSE APPEND(result, items / i)
+  END
+  WHILE NOT count >= 3 AND TRUE THEN
+    VAR count = count + 1
+  END
+  RETURN result
+END
+VAR greeting = "hi\\n" + "there"
+walk([1, 2, add(3, 4), "four", [5]])
+'''
+
+def python_value(value):
+  if isinstance(value, basic.List):
+    return [python_value(element) for element in value.elements]
+  return value.value
+
+def dump(value):
+  # A tree as nested tuples, to compare trees that are not the same objects
+  if isinstance(value, basic.Node):
+    names = [name for cls in type(value).__mro__ for name in cls.__dict__.get('__slots__', ())]
+    return (type(value).__name__,) + tuple((name, dump(getattr(value, name))) for name in names if hasattr(value, name))
+  if isinstance(value, basic.Token):
+    return ('Token', value.type, dump(value.value), value.start, value.end, value.source.fn)
+  if isinstance(value, basic.Position):
+    return ('Position', value.idx, value.is_end, value.source.fn)
+  if isinstance(value, (basic.Number, basic.String)):
+    return (type(value).__name__, value.value)
+  if isinstance(value, (list, tuple)):
+    return [dump(item) for item in value]
+  return value
+
+class ScriptTestCase(unittest.TestCase):
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.directory = directory.name
+    basic.parse_cache.clear()
+
+  def write(self, name, text):
+    path = os.path.join(self.directory, name)
+    with open(path, 'w') as f:
+      f.write(text)
+    return path
+
+  def run_text(self, text, mode='tree'):
+    result, error = basic.run('<test>', text, mode)
+    self.assertIsNone(error, error and error.as_string())
+    return result
+
+  def value(self, text, mode='tree'):
+    # The value of the last statement, as a Python value
+    return python_value(self.run_text(text, mode).elements[-1])
+
+#######################################
+# RUN
+#######################################
+
+class RunTest(ScriptTestCase):
+  def test_lazy_modes_skip_unused_bodies(self):
+    path = self.write('lib.myopl', 'FUN unused()\n  VAR = \nEND\nVAR run_lazy = 3\n')
+    for mode in LAZY_MODES:
+      with self.subTest(mode=mode):
+        self.run_text(f'RUN("{path}")', mode)
+        self.assertEqual(self.value('run_lazy', mode), 3)
+
+  def test_compiling_modes_parse_unused_bodies(self):
+    path = self.write('lib.myopl', 'FUN unused()\n  VAR = \nEND\n')
+    for mode in COMPILING_MODES:
+      with self.subTest(mode=mode):
+        _, error = basic.run('<test>', f'RUN("{path}")', mode)
+        self.assertIsNotNone(error)
+        self.assertIn('Invalid Syntax', error.as_string())
+
+#######################################
+# RECURSION
+#######################################
+
+class RecursionTest(ScriptTestCase):
+  def test_deep_recursion_is_a_runtime_error(self):
+    # The stack mode has a budget of its own, far deeper than Python's stack
+    self.run_text('FUN depth(n) -> IF n == 0 THEN 0 ELSE 1 + depth(n - 1)')
+    for mode in ('tree',) + COMPILING_MODES:
+      with self.subTest(mode=mode):
+        _, error = basic.run('<test>', 'depth(100000)', mode)
+        self.assertIsInstance(error, basic.RTError)
+        self.assertIn('Maximum recursion depth', error.as_string())
+        self.assertIn('in depth', error.generate_traceback())
+        self.assertEqual(self.value('depth(10)', mode), 10)
+
+#######################################
+# AST CACHE
+#######################################
+
+class AstCacheTest(ScriptTestCase):
+  def parse(self, path, lazy=False):
+    with open(path) as f:
+      node, error = basic.parse_file(path, f, lazy, basic.file_digest(f))
+    self.assertIsNone(error, error and error.as_string())
+    return node
+
+  def fresh_parse(self, path, lazy=False):
+    with open(path) as f:
+      ast = basic.Parser(basic.Lexer(path, f.read()).make_tokens()[0], lazy).parse()
+    self.assertIsNone(ast.error)
+    return ast.node
+
+  def test_round_trip(self):
+    path = self.write('program.myopl', PROGRAM)
+    for lazy in (False, True):
+      with self.subTest(lazy=lazy):
+        self.parse(path, lazy)
+        cache_path = basic.ast_cache_path(path, lazy)
+        self.assertTrue(os.path.exists(cache_path))
+
+        with open(path) as f:
+          key = (basic.file_mtime(path), basic.file_digest(f))
+        cached = basic.load_cached_ast(path, cache_path, key)
+        self.assertIsNotNone(cached)
+        self.assertEqual(dump(cached), dump(self.fresh_parse(path, lazy)))
+
+  def test_stale_cache_is_ignored(self):
+    path = self.write('program.myopl', PROGRAM)
+    self.parse(path)
+    self.write('program.myopl', PROGRAM.replace('count', 'total'))
+    self.assertEqual(dump(self.parse(path)), dump(self.fresh_parse(path)))
+
+  def test_corrupt_cache_is_ignored(self):
+    path = self.write('program.myopl', PROGRAM)
+    cache_path = basic.ast_cache_path(path, False)
+    self.parse(path)
+    with open(cache_path, 'rb') as f:
+      data = f.read()
+
+    for corrupt in (b'', b'garbage', data[:len(data) // 2], data[:-1]):
+      with self.subTest(size=len(corrupt)):
+        with open(cache_path, 'wb') as f:
+          f.write(corrupt)
+        self.assertEqual(dump(self.parse(path)), dump(self.fresh_parse(path)))
+
+        # The unreadable file was replaced
+        with open(cache_path, 'rb') as f:
+          self.assertEqual(f.read(), data)
+
+#######################################
+# PARSE CACHE
+#######################################
+
+class ParseCacheTest(ScriptTestCase):
+  def test_eviction_and_counters(self):
+    cache = basic.ParseCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    self.assertEqual(cache.get('a'), 1)
+    cache.put('c', 3)
+
+    # b was used least recently
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(cache.get('a'), 1)
+    self.assertEqual(cache.get('c'), 3)
+    self.assertEqual(list(cache.entries), ['a', 'c'])
+    self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    cache.clear()
+    self.assertEqual((len(cache.entries), cache.hits, cache.misses), (0, 0, 0))
+
+  def test_run_reuses_parse(self):
+    self.value('1 + 2')
+    misses = basic.parse_cache.misses
+    self.assertEqual(self.value('1 + 2'), 3)
+    self.assertEqual(basic.parse_cache.misses, misses)
+    self.assertEqual(basic.parse_cache.hits, 1)
+
+  def test_cached_tree_is_not_annotated(self):
+    # A function from an earlier run still works after the same text runs again
+    definition = 'FUN f() -> FOR i = 0 TO 3 THEN i'
+    for mode in LAZY_MODES + COMPILING_MODES:
+      with self.subTest(mode=mode):
+        self.run_text(definition, mode)
+        self.run_text('VAR g = f', mode)
+        self.run_text(definition, mode)
+        self.assertEqual(self.value('g()', mode), [0, 1, 2])
+
+#######################################
+# IMPORT
+#######################################
+
+class ImportTest(ScriptTestCase):
+  def test_import_runs_once_until_the_file_changes(self):
+    path = self.write('module.myopl', 'APPEND(import_log, 1)\nFUN module_value() -> 1\n')
+    self.run_text('VAR import_log = []')
+    self.run_text(f'IMPORT("{path}")')
+    self.run_text(f'IMPORT("{path}")')
+    self.assertEqual(self.value('import_log'), [1])
+    self.assertEqual(self.value('module_value()'), 1)
+
+    # The same size and modification time, but different text
+    stat = os.stat(path)
+    self.write('module.myopl', 'APPEND(import_log, 2)\nFUN module_value() -> 2\n')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    self.assertEqual(os.stat(path).st_size, stat.st_size)
+
+    self.run_text(f'IMPORT("{path}")')
+    self.assertEqual(self.value('import_log'), [1, 2])
+    self.assertEqual(self.value('module_value()'), 2)
+
+  def test_import_cycle_terminates(self):
+    a_path = os.path.join(self.directory, 'a.myopl')
+    b_path = self.write('b.myopl', f'IMPORT("{a_path}")\nVAR b_value = a_value + 1\n')
+    self.write('a.myopl', f'VAR a_value = 1\nIMPORT("{b_path}")\nVAR a_total = a_value + b_value\n')
+
+    for mode in LAZY_MODES + COMPILING_MODES:
+      with self.subTest(mode=mode):
+        basic.module_cache.clear()
+        self.run_text(f'IMPORT("{a_path}")', mode)
+        self.assertEqual(self.value('a_total', mode), 3)
+
+if __name__ == '__main__':
+  unittest.main()